@@ -0,0 +1,202 @@
+"""Batch solving of Kakuro puzzles across a process pool.
+
+    >>> from corpus import iter_puzzles
+    >>> for result in solve_many(iter_puzzles('puzzles.txt'), workers=4):   # doctest: +SKIP
+    ...     print(result.name, result.status, result.seconds)
+
+Puzzles are sent to the workers in chunks and results stream back as chunks finish, in input
+order or as they complete. Each puzzle is solved under its own optional time limit; a puzzle
+that fails or times out only marks its own result, and one that takes its worker down only
+marks its own chunk.
+"""
+
+import os
+import signal
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from time import perf_counter
+
+import kakuro
+
+# How each puzzle is modelled and searched: the keyword arguments of Kakuro and of kakuro.search_config
+# (and stats=True to record a SearchStats of each solve)
+DEFAULT_CONFIG = dict(encoding='hidden', bitmask=False,
+                      select='mrv', order='unordered', inference='fc', propagation='AC3b', stats=False)
+
+# status is 'solved', 'unsolvable', 'timeout' or 'error'; solution maps cells to digits when solved;
+# stats is the SearchStats of the solve as a dict (SearchStats.as_dict) if config['stats'], else None
+SolveResult = namedtuple('SolveResult', 'index name status solution seconds assignments error stats',
+                         defaults=(None,))
+
+
+class SolveTimeout(Exception):
+    """Raised in a worker when a puzzle runs out of time."""
+
+
+def full_config(config=None):
+    """Return DEFAULT_CONFIG updated with config; raise ValueError on unknown keys or names."""
+    full = dict(DEFAULT_CONFIG, **(config or {}))
+    unknown = set(full) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError('unknown config keys: {}'.format(', '.join(sorted(unknown))))
+    try:
+        kakuro.search_config(full['select'], full['order'], full['inference'], full['propagation'])
+    except KeyError as e:
+        raise ValueError('unknown heuristic: {}'.format(e)) from None
+    return full
+
+
+def init_worker(max_length=6, tables=False):
+    """Process pool initializer: build the shared run domains (and tables) once per worker."""
+    kakuro.warm_tables(max_length, tables)
+
+
+def _on_alarm(signum, frame):
+    raise SolveTimeout()
+
+
+def solve_one(index, name, grid, config, timeout=None):
+    """Solve one puzzle under config and return its SolveResult; never raises. The time limit
+    is only enforced in the main thread, where SIGALRM can be handled."""
+    timed = (timeout is not None and hasattr(signal, 'setitimer')
+             and threading.current_thread() is threading.main_thread())
+    if timed:
+        previous = signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    start = perf_counter()
+    problem = None
+    try:
+        try:
+            problem = kakuro.Kakuro(grid, bitmask=config['bitmask'], encoding=config['encoding'])
+            if config['stats']:
+                problem.stats = kakuro.SearchStats()
+            assignment = kakuro.backtracking_search(problem, **kakuro.search_config(
+                config['select'], config['order'], config['inference'], config['propagation']))
+        finally:
+            # Disarmed before the handlers below, so that an alarm going off late still
+            # lands in them as a SolveTimeout
+            if timed:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        if assignment is None:
+            status, solution, error = 'unsolvable', None, None
+        else:
+            status, solution, error = 'solved', {v: x for v, x in assignment.items() if v[0] == 'X'}, None
+    except SolveTimeout:
+        status, solution, error = 'timeout', None, None
+    except Exception as e:
+        status, solution, error = 'error', None, repr(e)
+    finally:
+        if timed:
+            signal.signal(signal.SIGALRM, previous)
+    return SolveResult(index, name, status, solution, perf_counter() - start,
+                       problem.nassigns if problem else 0, error,
+                       problem.stats.as_dict() if problem and problem.stats is not None else None)
+
+
+def solve_chunk(chunk, config, timeout=None):
+    """Solve a list of (index, name, grid) and return their results."""
+    return [solve_one(index, name, grid, config, timeout) for index, name, grid in chunk]
+
+
+def solve_isolated(index, name, grid, config, timeout=None):
+    """Solve one puzzle in a worker process of its own, so that if it takes the worker down,
+    only this puzzle is marked as an error."""
+    with ProcessPoolExecutor(1) as executor:
+        try:
+            return executor.submit(solve_one, index, name, grid, config, timeout).result()
+        except BrokenProcessPool as e:
+            return SolveResult(index, name, 'error', None, 0.0, 0, repr(e))
+
+
+def numbered(puzzles):
+    """Yield (index, name, grid) for puzzles given as grids or as (name, grid) pairs."""
+    for index, puzzle in enumerate(puzzles):
+        if isinstance(puzzle, tuple):
+            yield (index,) + puzzle
+        else:
+            yield index, None, puzzle
+
+
+def chunked(iterable, size):
+    """Yield lists of up to size consecutive items of iterable."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def solve_many(puzzles, workers=None, config=None, chunksize=8, ordered=True, timeout=None,
+               max_pending=None, warm_length=6):
+    """Solve puzzles, an iterable of grids or of (name, grid) pairs such as iter_puzzles yields,
+    and yield a SolveResult for each.
+
+    workers processes solve chunks of chunksize puzzles (workers=0 solves in this process;
+    None means os.cpu_count()). Results come in input order if ordered, else as chunks finish.
+    The input is consumed lazily: at most max_pending chunks (default 4 per worker) are in
+    flight. Each puzzle gets timeout seconds (None for no limit); the time limit relies on
+    SIGALRM, so it is not enforced on platforms without it, nor with workers=0 outside the
+    main thread. When a worker dies, the pool is replaced and the puzzles of the chunks in
+    flight are solved again one by one, each in a process of its own. Workers build the run
+    tables up to warm_length cells once at startup.
+    """
+    config = full_config(config)
+    tables = config['bitmask'] and config['encoding'] == 'hidden'
+    chunks = chunked(numbered(puzzles), chunksize)
+
+    if workers == 0:
+        init_worker(warm_length, tables)
+        for chunk in chunks:
+            yield from solve_chunk(chunk, config, timeout)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 4 * workers
+
+    def new_pool():
+        return ProcessPoolExecutor(workers, initializer=init_worker, initargs=(warm_length, tables))
+
+    pool = [new_pool()]  # The current pool; replaced when a worker dies
+    pending = deque()  # (future, pool, chunk), in submission order
+
+    def replace(executor):
+        if executor is pool[0]:
+            executor.shutdown(wait=False)
+            pool[0] = new_pool()
+
+    def submit():
+        for chunk in chunks:
+            try:
+                future = pool[0].submit(solve_chunk, chunk, config, timeout)
+            except BrokenProcessPool:
+                # A worker died since the last submission; the chunks in flight on the old pool
+                # fail on their own when collected
+                replace(pool[0])
+                future = pool[0].submit(solve_chunk, chunk, config, timeout)
+            pending.append((future, pool[0], chunk))
+            if len(pending) >= max_pending:
+                return
+
+    try:
+        submit()
+        while pending:
+            if ordered:
+                entry = pending.popleft()
+            else:
+                wait([future for future, _, _ in pending], return_when=FIRST_COMPLETED)
+                entry = next(entry for entry in pending if entry[0].done())
+                pending.remove(entry)
+            future, executor, chunk = entry
+            try:
+                results = future.result()
+            except BrokenProcessPool:
+                # A worker died and took the pool, with every chunk in flight, down with it
+                replace(executor)
+                results = [solve_isolated(index, name, grid, config, timeout) for index, name, grid in chunk]
+            yield from results
+            submit()
+    finally:
+        pool[0].shutdown(cancel_futures=True)
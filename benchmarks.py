@@ -0,0 +1,822 @@
+"""Benchmarks for the Kakuro solver.
+
+Run with `python benchmarks.py [name ...]`; with no names, every benchmark runs.
+"""
+
+import os
+import random
+import subprocess
+import sys
+import tracemalloc
+from functools import partial
+from itertools import permutations
+from time import perf_counter
+from unittest import mock
+
+import batch
+import generator
+import kakuro
+import local_search
+
+
+def best_time(fn, *args, repeat=5, **kwargs):
+    """Return the best wall-clock time in seconds of repeat calls of fn(*args, **kwargs)."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        fn(*args, **kwargs)
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def build_cold(puzzle, **kwargs):
+    """Build Kakuro(puzzle, **kwargs) with no run domains or tables cached from earlier builds."""
+    kakuro.clear_tables()
+    return kakuro.Kakuro(puzzle, **kwargs)
+
+
+def puzzle_size(puzzle):
+    """Return 'rowsxcols' for a puzzle grid."""
+    return '{}x{}'.format(len(puzzle), max(len(row) for row in puzzle))
+
+
+# ______________________________________________________________________________
+# Model construction
+
+
+def legacy_run_domain(length, total):
+    """Run domain as Kakuro built it before the sum-combination table."""
+    perms = list(map("".join, permutations('123456789', length)))
+    return [perm for perm in perms if sum(int(x) for x in perm) == total]
+
+
+def bench_construction(repeat=5):
+    """Kakuro construction time per puzzle, with permutation filtering (before)
+    and with the sum-combination table (after)."""
+    print('{:<18}{:>8}{:>12}{:>12}{:>10}'.format('puzzle', 'size', 'before (s)', 'after (s)', 'speedup'))
+    for name, puzzle in kakuro.PUZZLES.items():
+        with mock.patch.object(kakuro, 'run_domain', legacy_run_domain):
+            before = best_time(kakuro.Kakuro, puzzle, repeat=repeat)
+        after = best_time(build_cold, puzzle, repeat=repeat)
+        print('{:<18}{:>8}{:>12.4f}{:>12.4f}{:>9.1f}x'.format(name, puzzle_size(puzzle), before, after, before / after))
+
+
+# ______________________________________________________________________________
+# Constraint checks
+
+
+def legacy_kakuro_constraint(A, a, B, b):
+    """Kakuro.kakuro_constraint as it parsed variable names before the compiled model."""
+    if A[0] == "C":
+        A, a, B, b = B, b, A, a
+    X_i, X_j = int(A[1:A.index(",")]), int(A[A.index(",") + 1:])
+    C_i, C_j = int(B[3:B.index(",")]), int(B[B.index(",") + 1:])
+    ind = X_i - C_i - 1 if B[2] == "d" else X_j - C_j - 1
+    return b[ind] == a
+
+
+def bench_constraint(repeat=5, values=50):
+    """Time of checking every cell-run arc, both ways, against up to values run
+    permutations, with name parsing (before) and the compiled arc table (after)."""
+    print('{:<18}{:>10}{:>12}{:>12}{:>10}'.format('puzzle', 'checks', 'before (s)', 'after (s)', 'speedup'))
+    for name, puzzle in kakuro.PUZZLES.items():
+        problem = kakuro.Kakuro(puzzle)
+        checks = [(cell, digit, run, perm) for run in problem.runs for cell in problem.neighbors[run]
+                  for digit in problem.domains[cell] for perm in problem.domains[run][:values]]
+        checks += [(run, perm, cell, digit) for cell, digit, run, perm in checks]
+
+        def run_checks(constraint):
+            for A, a, B, b in checks:
+                constraint(A, a, B, b)
+
+        before = best_time(run_checks, legacy_kakuro_constraint, repeat=repeat)
+        after = best_time(run_checks, problem.constraints, repeat=repeat)
+        print('{:<18}{:>10}{:>12.4f}{:>12.4f}{:>9.1f}x'.format(name, len(checks), before, after, before / after))
+
+
+# ______________________________________________________________________________
+# Run encodings
+
+
+def solve(puzzle, config, **kwargs):
+    """Build Kakuro(puzzle, **kwargs), solve it with backtracking_search(**config)
+    and return (seconds, assignments made, solved)."""
+    start = perf_counter()
+    problem = kakuro.Kakuro(puzzle, **kwargs)
+    result = kakuro.backtracking_search(problem, **config)
+    return perf_counter() - start, problem.nassigns, result is not None
+
+
+ENCODINGS = {
+    'hidden FC': (dict(), dict(select_unassigned_variable=kakuro.mrv, inference=kakuro.forward_checking)),
+    'hidden bitmask FC': (dict(bitmask=True),
+                          dict(select_unassigned_variable=kakuro.mrv, inference=kakuro.forward_checking)),
+    'nary FC': (dict(encoding='nary'),
+                dict(select_unassigned_variable=kakuro.mrv, inference=kakuro.forward_checking)),
+    'nary sum': (dict(encoding='nary'),
+                 dict(select_unassigned_variable=kakuro.mrv, inference=kakuro.sum_propagation)),
+}
+
+
+def bench_solves(configs, skip=()):
+    """Print build + solve time and assignments per bundled puzzle for each of configs,
+    a dict of {label: (Kakuro kwargs, backtracking_search kwargs)}, except the (puzzle, label) in skip."""
+    print('{:<18}{:<20}{:>10}{:>10}'.format('puzzle', 'config', 'time (s)', 'assigns'))
+    for name, puzzle in kakuro.PUZZLES.items():
+        for label, (kwargs, config) in configs.items():
+            if (name, label) in skip:
+                continue
+            seconds, nassigns, solved = solve(puzzle, config, **kwargs)
+            print('{:<18}{:<20}{:>10.3f}{:>10}{}'.format(name, label, seconds, nassigns,
+                                                         '' if solved else '  (no solution)'))
+
+
+def bench_encodings():
+    """Hidden-variable against nary encoding of runs. (Hidden MAC is left out: it takes minutes on hard8x8.)"""
+    bench_solves(ENCODINGS)
+
+
+PROPAGATIONS = {
+    'MAC AC3b': (dict(), dict(select_unassigned_variable=kakuro.mrv, inference=kakuro.mac)),
+    'MAC compact-table': (dict(bitmask=True),
+                          dict(select_unassigned_variable=kakuro.mrv,
+                               inference=partial(kakuro.mac, constraint_propagation=kakuro.compact_table))),
+}
+
+
+def bench_propagation():
+    """MAC with AC3b against MAC with compact-table propagation over the bitset table constraints,
+    hidden encoding. (AC3b is left out on hard8x8: it takes minutes.)"""
+    bench_solves(PROPAGATIONS, skip={('hard8x8', 'MAC AC3b')})
+
+
+RESIDUE_PROPAGATIONS = {'AC3': kakuro.AC3, 'AC3b': kakuro.AC3b, 'AC3rm': kakuro.AC3rm}
+RESIDUE_PUZZLES = [('given5x7', 'hidden'), ('intermediate6x6', 'hidden'), ('given5x7', 'nary'),
+                   ('intermediate6x6', 'nary'), ('hard8x8', 'nary'), ('given14x14', 'nary')]
+
+
+def bench_residues(seed=0):
+    """Constraint checks and time of MAC + bucket_mrv with AC3, AC3b and AC3rm (residual
+    supports), summing the checks each propagation reports. (Hidden hard8x8 and given14x14
+    are left out: AC3 and AC3b take minutes on them.)"""
+    print('{:<18}{:<10}{:<8}{:>10}{:>12}{:>10}'.format('puzzle', 'encoding', 'AC', 'assigns', 'checks', 'time (s)'))
+    for name, encoding in RESIDUE_PUZZLES:
+        for label, propagation in RESIDUE_PROPAGATIONS.items():
+            checks = []
+
+            def counted(csp, queue=None, removals=None):
+                consistent, n = propagation(csp, queue, removals)
+                checks.append(n)
+                return consistent, n
+
+            random.seed(seed)
+            problem = kakuro.Kakuro(kakuro.PUZZLES[name], encoding=encoding)
+            start = perf_counter()
+            kakuro.backtracking_search(problem, kakuro.bucket_mrv, inference=partial(kakuro.mac, constraint_propagation=counted))
+            print('{:<18}{:<10}{:<8}{:>10}{:>12}{:>10.3f}'.format(name, encoding, label, problem.nassigns, sum(checks),
+                                                                  perf_counter() - start))
+    check_residues_set_sum()
+
+
+def check_residues_set_sum():
+    """AC3rm after Kakuro.set_sum must not use residues of the old sum: it has to agree with
+    AC3 on a model built from scratch with the new clue."""
+    for encoding in ('hidden', 'nary'):
+        problem = kakuro.Kakuro(kakuro.PUZZLES['given5x7'], encoding=encoding)
+        kakuro.AC3rm(problem)
+        for run in problem.runs:
+            length = len(problem.run_cells[problem.run_ids[run]])
+            problem.set_sum(run, length * (length + 1) // 2)  # The smallest sum: one digit set
+        consistent, _ = kakuro.AC3rm(problem)
+        fresh = kakuro.Kakuro(problem.puzzle, encoding=encoding)
+        assert consistent == kakuro.AC3(fresh)[0]
+        assert not consistent or problem.curr_domains == fresh.curr_domains
+
+
+ARC_HEURISTICS = {'none': kakuro.no_arc_heuristic, 'dom_j_up': kakuro.dom_j_up, 'dom_j_buckets': kakuro.dom_j_buckets}
+ARC_PUZZLES = [('given5x7', 'hidden'), ('hard8x8', 'nary'), ('given14x14', 'nary')]
+
+
+def bench_arc_queue(seed=0, arcs=40, repeat=2000):
+    """Arc queue of AC3 and AC3b under MAC + bucket_mrv: unordered (a set), dom_j_up (a
+    SortedSet built at each call) and dom_j_buckets (ArcQueue), with assignments, checks per
+    assignment and time per assignment; then the time to build and drain a queue of arcs
+    arcs, as every call of mac does."""
+    print('{:<18}{:<10}{:<6}{:<15}{:>10}{:>14}{:>16}'.format(
+        'puzzle', 'encoding', 'AC', 'queue', 'assigns', 'checks/assign', 'us/assign'))
+    for name, encoding in ARC_PUZZLES:
+        for propagation in (kakuro.AC3, kakuro.AC3b):
+            for label, heuristic in ARC_HEURISTICS.items():
+                checks = []
+
+                def counted(csp, queue=None, removals=None):
+                    consistent, n = propagation(csp, queue, removals, arc_heuristic=heuristic)
+                    checks.append(n)
+                    return consistent, n
+
+                random.seed(seed)
+                problem = kakuro.Kakuro(kakuro.PUZZLES[name], encoding=encoding)
+                start = perf_counter()
+                kakuro.backtracking_search(problem, kakuro.bucket_mrv,
+                                           inference=partial(kakuro.mac, constraint_propagation=counted))
+                seconds = perf_counter() - start
+                print('{:<18}{:<10}{:<6}{:<15}{:>10}{:>14.1f}{:>16.1f}'.format(
+                    name, encoding, propagation.__name__, label, problem.nassigns,
+                    sum(checks) / problem.nassigns, seconds / problem.nassigns * 1e6))
+
+    problem = kakuro.Kakuro(kakuro.PUZZLES['given14x14'], encoding='nary')
+    problem.support_pruning()
+    queue = {(Xi, Xj) for Xi in problem.variables for Xj in problem.neighbors[Xi]}
+    queue = set(list(queue)[:arcs])
+
+    def drain(heuristic):
+        for _ in range(repeat):
+            q = heuristic(problem, set(queue))
+            while q:
+                q.pop()
+
+    print()
+    print('{:<15}{:>20}'.format('queue', 'us per build+drain'))
+    for label, heuristic in ARC_HEURISTICS.items():
+        print('{:<15}{:>20.1f}'.format(label, best_time(drain, heuristic, repeat=3) / repeat * 1e6))
+    check_drop_arc()
+
+
+def check_drop_arc():
+    """drop_arc must take the arc out of every kind of queue, even once the domain of its Xj
+    has shrunk since it was queued."""
+    problem = kakuro.Kakuro(kakuro.PUZZLES['given5x7'], encoding='nary')
+    problem.support_pruning()
+    arcs = [(Xi, Xj) for Xi in problem.variables for Xj in problem.neighbors[Xi]]
+    for heuristic in ARC_HEURISTICS.values():
+        queue = heuristic(problem, set(arcs))
+        Xi, Xj = arc = arcs[len(arcs) // 2]
+        for value in problem.choices(Xj)[1:]:
+            problem.prune(Xj, value, None)
+        kakuro.drop_arc(queue, arc)
+        assert arc not in queue and len(queue) == len(arcs) - 1
+        problem.curr_domains = None
+        problem.support_pruning()
+
+
+# ______________________________________________________________________________
+# Compatibility matrices
+
+
+MATRIX_PUZZLES = [('given5x7', 'hidden'), ('hard8x8', 'hidden'), ('given14x14', 'hidden'),
+                  ('given5x7', 'nary'), ('intermediate6x6', 'nary')]
+
+
+def bench_matrices(seed=0, sizes=(4, 8, 16, 32, 64, 128, 256, 512, 1024), tightness=(0.5, 0.9), repeat=200):
+    """Time of a revision of an arc between two variables of size values each, half of them
+    in their current domains, under a random constraint ruling out a tightness fraction of
+    the pairs: scalar (revise calling csp.constraints) and vectorized (CompatibilityMatrices),
+    and the crossover, the smallest size from which the matrices win. Then the time of MAC
+    AC3b + mrv on MATRIX_PUZZLES both ways: Kakuro cells have 9 values, hidden variables up
+    to thousands."""
+    print('{:<11}{:>6}{:>14}{:>14}{:>10}'.format('tightness', 'size', 'scalar (us)', 'matrix (us)', 'speedup'))
+    for t in tightness:
+        crossover = None
+        for size in sizes:
+            rng = random.Random(seed)
+            allowed = {(a, b) for a in range(size) for b in range(size) if rng.random() >= t}
+            csp = kakuro.CSP(['A', 'B'], {'A': list(range(size)), 'B': list(range(size))}, {'A': ['B'], 'B': ['A']},
+                             lambda A, a, B, b: ((a, b) if A == 'A' else (b, a)) in allowed)
+            csp.support_pruning()
+            Di, Dj = (sum(1 << i for i in rng.sample(range(size), size // 2)) for _ in range(2))
+
+            def revisions():
+                for _ in range(repeat):
+                    csp.curr_domains['A'], csp.curr_domains['B'] = Di, Dj
+                    kakuro.revise(csp, 'A', 'B', None)
+
+            times = []
+            for matrices in (None, kakuro.CompatibilityMatrices()):
+                csp.matrices = matrices
+                revisions()  # Builds the matrix
+                times.append(best_time(revisions, repeat=3) / repeat * 1e6)
+            if crossover is None and times[1] < times[0]:
+                crossover = size
+            print('{:<11}{:>6}{:>14.1f}{:>14.1f}{:>9.1f}x'.format(t, size, times[0], times[1], times[0] / times[1]))
+        print('crossover at tightness {}: {}\n'.format(t, 'size ' + str(crossover) if crossover else 'none'))
+
+    print('{:<18}{:<10}{:>10}{:>12}{:>14}'.format('puzzle', 'encoding', 'assigns', 'scalar (s)', 'matrices (s)'))
+    for name, encoding in MATRIX_PUZZLES:
+        row = []
+        for matrices in (False, True):
+            random.seed(seed)
+            problem = kakuro.Kakuro(kakuro.PUZZLES[name], encoding=encoding)
+            if matrices:
+                problem.matrices = kakuro.CompatibilityMatrices()
+            start = perf_counter()
+            kakuro.backtracking_search(problem, kakuro.mrv, inference=kakuro.mac)
+            row.append(perf_counter() - start)
+        print('{:<18}{:<10}{:>10}{:>12.3f}{:>14.3f}'.format(name, encoding, problem.nassigns, *row))
+
+
+# ______________________________________________________________________________
+# Domain undo
+
+
+class LegacyListDomains:
+    """The CSP domain store before the trail: current domains are lists, prune calls list.remove,
+    and restore appends the removals of a supposition back."""
+
+    def support_pruning(self):
+        if self.curr_domains is None:
+            self.curr_domains = {v: list(self.domains[v]) for v in self.variables}
+
+    def suppose(self, var, value):
+        self.support_pruning()
+        removals = [(var, a) for a in self.curr_domains[var] if a != value]
+        self.curr_domains[var] = [value]
+        return removals
+
+    def prune(self, var, value, removals):
+        self.curr_domains[var].remove(value)
+        if removals is not None:
+            removals.append((var, value))
+
+    def choices(self, var):
+        return (self.curr_domains or self.domains)[var]
+
+    def domain_size(self, var):
+        return len(self.choices(var))
+
+    def forward_check(self, var, value, B, removals):
+        for b in self.choices(B)[:]:
+            if not self.constraints(var, value, B, b):
+                self.prune(B, b, removals)
+        return bool(self.choices(B))
+
+    def restore(self, removals):
+        for B, b in removals:
+            self.curr_domains[B].append(b)
+
+
+class LegacyKakuro(LegacyListDomains, kakuro.Kakuro):
+    """Kakuro (hidden encoding, no tables) over the list domain store."""
+
+
+UNDO_SEARCHES = {
+    'FC': dict(select_unassigned_variable=kakuro.mrv, inference=kakuro.forward_checking),
+    'MAC': dict(select_unassigned_variable=kakuro.mrv, inference=kakuro.mac),
+}
+
+
+def bench_undo(seed=0):
+    """Search time per assignment with list domains and removal lists (before) and with bitset
+    domains and the trail (after), hidden encoding. Ties of MRV are broken by the same random
+    seed, but the two stores list values in different orders, so the searches can differ.
+    (MAC is left out on hard8x8: it takes minutes.)"""
+    print('{:<18}{:<6}{:>20}{:>20}{:>10}'.format('puzzle', 'search', 'before (us/assign)', 'after (us/assign)',
+                                                 'speedup'))
+    for name, puzzle in kakuro.PUZZLES.items():
+        for label, config in UNDO_SEARCHES.items():
+            if (name, label) == ('hard8x8', 'MAC'):
+                continue
+            times = []
+            for cls in (LegacyKakuro, kakuro.Kakuro):
+                random.seed(seed)
+                problem = cls(puzzle)
+                start = perf_counter()
+                kakuro.backtracking_search(problem, **config)
+                times.append((perf_counter() - start) / problem.nassigns * 1e6)
+            print('{:<18}{:<6}{:>20.1f}{:>20.1f}{:>9.1f}x'.format(name, label, *times, times[0] / times[1]))
+
+
+# ______________________________________________________________________________
+# Variable selection
+
+
+def synthetic_grid(rows, cols, seed=0):
+    """Return a rows x cols Kakuro grid with the layout, fill and clues of the generator,
+    without making its solution unique."""
+    rng = random.Random(seed)
+    white = generator.make_layout(rows, cols, 0.6, rng, max_run=5)
+    return generator.clue_grid(white, generator.fill_layout(white, rng))
+
+
+SELECTION_SEARCHES = {
+    'hidden FC': (dict(), kakuro.forward_checking),
+    'hidden bitmask FC': (dict(bitmask=True), kakuro.forward_checking),
+    'nary sum': (dict(encoding='nary'), kakuro.sum_propagation),
+}
+
+
+def bench_selection(max_nodes=2000, synthetic=2, seed=0):
+    """Time per assignment of the search for a first solution with mrv (before) and bucket_mrv
+    (after), on given14x14 and on synthetic 40x40 grids, up to max_nodes assignments. The
+    synthetic grids have many solutions and the search can thrash, hence the cap."""
+    # The search recurses once per variable, and 40x40 grids have more than a thousand
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    puzzles = {'given14x14': kakuro.PUZZLES['given14x14']}
+    puzzles.update(('synthetic40x40-{}'.format(n), synthetic_grid(40, 40, n)) for n in range(synthetic))
+    print('{:<18}{:<20}{:>9}{:>20}{:>9}{:>20}{:>10}'.format(
+        'puzzle', 'search', 'assigns', 'before (us/assign)', 'assigns', 'after (us/assign)', 'speedup'))
+    for name, puzzle in puzzles.items():
+        for label, (kwargs, inference) in SELECTION_SEARCHES.items():
+            row = []
+            for select in (kakuro.mrv, kakuro.bucket_mrv):
+                random.seed(seed)
+                problem = kakuro.Kakuro(puzzle, **kwargs)
+                start = perf_counter()
+                next(kakuro.iter_solutions(problem, 1, select, inference=inference, max_nodes=max_nodes), None)
+                row += [problem.nassigns, (perf_counter() - start) / problem.nassigns * 1e6]
+            print('{:<18}{:<20}{:>9}{:>20.1f}{:>9}{:>20.1f}{:>9.1f}x'.format(name, label, *row, row[1] / row[3]))
+
+
+# ______________________________________________________________________________
+# Explicit-stack search
+
+
+ITERATIVE_SEARCHES = {
+    'hidden bitmask FC': (dict(bitmask=True), kakuro.forward_checking),
+    'nary FC': (dict(encoding='nary'), kakuro.forward_checking),
+    'nary sum': (dict(encoding='nary'), kakuro.sum_propagation),
+}
+
+
+def bench_iterative(seed=0, slice_nodes=100, deep=60):
+    """Assignments per second of the search for a first solution (bucket_mrv) with the
+    recursive backtracking_search and the explicit-stack iterative_backtracking_search, which
+    make the same assignments; then the iterative search paused every slice_nodes assignments
+    and resumed. Last, the fill of the generator on a deep x deep layout, a search with a
+    level per white cell, both ways, under the default recursion limit."""
+    print('{:<18}{:<20}{:>9}{:>16}{:>16}{:>16}'.format(
+        'puzzle', 'search', 'assigns', 'recursive (/s)', 'iterative (/s)', 'resumed (/s)'))
+    for name in ('hard8x8', 'given14x14'):
+        for label, (kwargs, inference) in ITERATIVE_SEARCHES.items():
+            row = []
+            for search in (kakuro.backtracking_search, kakuro.iterative_backtracking_search, None):
+                random.seed(seed)
+                problem = kakuro.Kakuro(kakuro.PUZZLES[name], **kwargs)
+                start = perf_counter()
+                if search is None:
+                    paused = kakuro.BacktrackingSearch(problem, kakuro.bucket_mrv, inference=inference)
+                    while paused.resume(slice_nodes) is None and not paused.finished:
+                        pass
+                else:
+                    search(problem, kakuro.bucket_mrv, inference=inference)
+                row.append((problem.nassigns, problem.nassigns / (perf_counter() - start)))
+            assert row[0][0] == row[1][0] == row[2][0]
+            print('{:<18}{:<20}{:>9}{:>16.0f}{:>16.0f}{:>16.0f}'.format(name, label, row[0][0],
+                                                                        *(rate for _, rate in row)))
+
+    white = generator.make_layout(deep, deep, 0.6, random.Random(seed), max_run=5)
+    cells = sum(map(sum, white))
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(1000)
+    try:
+        print()
+        for label, search in (('recursive', kakuro.backtracking_search), ('iterative', kakuro.iterative_backtracking_search)):
+            with mock.patch.object(generator, 'iterative_backtracking_search', search):
+                start = perf_counter()
+                try:
+                    generator.fill_layout(white, random.Random(seed))
+                    outcome = 'filled in {:.2f} s'.format(perf_counter() - start)
+                except RecursionError:
+                    outcome = 'RecursionError'
+            print('fill {}x{} ({} cells), {}: {}'.format(deep, deep, cells, label, outcome))
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+# ______________________________________________________________________________
+# Search statistics
+
+
+STATS_SEARCHES = {
+    'hidden FC': (dict(), kakuro.forward_checking),
+    'hidden MAC': (dict(), kakuro.mac),
+    'nary FC': (dict(encoding='nary'), kakuro.forward_checking),
+    'nary sum': (dict(encoding='nary'), kakuro.sum_propagation),
+}
+
+
+def bench_stats(seed=0, repeat=3):
+    """Time of the search for a first solution (mrv) with csp.stats None and with a
+    SearchStats recording it, best of repeat, and the overhead of recording."""
+    print('{:<18}{:<14}{:>9}{:>12}{:>12}{:>11}'.format('puzzle', 'search', 'assigns', 'off (s)', 'on (s)', 'overhead'))
+    for name in ('hard8x8', 'given14x14'):
+        for label, (kwargs, inference) in STATS_SEARCHES.items():
+            if name == 'given14x14' and label == 'nary FC':
+                continue  # Takes minutes
+            times = []
+            for record in (False, True):
+                best = float('inf')
+                for _ in range(repeat):
+                    random.seed(seed)
+                    problem = kakuro.Kakuro(kakuro.PUZZLES[name], **kwargs)
+                    if record:
+                        problem.stats = kakuro.SearchStats()
+                    start = perf_counter()
+                    kakuro.backtracking_search(problem, kakuro.mrv, inference=inference)
+                    best = min(best, perf_counter() - start)
+                times.append(best)
+            print('{:<18}{:<14}{:>9}{:>12.3f}{:>12.3f}{:>10.0f}%'.format(
+                name, label, problem.nassigns, times[0], times[1], 100 * (times[1] / times[0] - 1)))
+
+
+# ______________________________________________________________________________
+# Conflict-directed ordering
+
+
+WDEG_SEARCHES = {
+    'hidden bitmask FC': (dict(bitmask=True), kakuro.forward_checking),
+    'nary sum': (dict(encoding='nary'), kakuro.sum_propagation),
+}
+
+
+def bench_wdeg(max_nodes=20000, synthetic=6, size=12, seed=0):
+    """Assignments and time of the search for a first solution with bucket_mrv and dom_wdeg,
+    up to max_nodes assignments, on synthetic grids where MRV can thrash, with the number of
+    constraints dom_wdeg weighted and the wipeouts of the heaviest one."""
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    print('{:<18}{:<20}{:>9}{:>10}{:>9}{:>10}{:>13}{:>10}'.format(
+        'puzzle', 'search', 'mrv', 'time (s)', 'wdeg', 'time (s)', 'weighted', 'heaviest'))
+    for n in range(synthetic):
+        puzzle = synthetic_grid(size, size, n)
+        for label, (kwargs, inference) in WDEG_SEARCHES.items():
+            row = []
+            for select in (kakuro.bucket_mrv, kakuro.dom_wdeg):
+                random.seed(seed)
+                problem = kakuro.Kakuro(puzzle, **kwargs)
+                start = perf_counter()
+                solution = next(kakuro.iter_solutions(problem, 1, select, inference=inference,
+                                                      max_nodes=max_nodes), None)
+                row += ['{}{}'.format(problem.nassigns, '' if solution else '+'), perf_counter() - start]
+            weights = problem.constraint_weights()
+            print('{:<18}{:<20}{:>9}{:>10.3f}{:>9}{:>10.3f}{:>13}{:>10}'.format(
+                'synthetic{}x{}-{}'.format(size, size, n), label, *row, len(weights), max(weights.values(), default=0)))
+    print("('+': no solution within max_nodes)")
+
+
+# ______________________________________________________________________________
+# Backjumping
+
+
+BACKJUMP_SEARCHES = {
+    'hidden bitmask FC': dict(bitmask=True),
+    'nary FC': dict(encoding='nary'),
+}
+
+
+def bench_backjumping(seeds=5, max_nogoods=1000):
+    """Assignments of the search for a first solution (FC + bucket_mrv) with chronological
+    backtracking, conflict-directed backjumping and backjumping with up to max_nogoods
+    nogoods, summed over seeds for the random ties of bucket_mrv, and the share of the
+    assignments of backtracking that backjumping (without nogoods) saves."""
+    searches = [('BT', kakuro.backtracking_search, {}), ('CBJ', kakuro.cbj_search, {}),
+                ('CBJ+nogoods', kakuro.cbj_search, dict(max_nogoods=max_nogoods))]
+    print('{:<18}{:<20}'.format('puzzle', 'search')
+          + ''.join('{:>12}{:>10}'.format(label, 'time (s)') for label, _, _ in searches) + '{:>8}'.format('saved'))
+    for name in ('given5x7', 'intermediate6x6', 'hard8x8', 'given14x14'):
+        for label, kwargs in BACKJUMP_SEARCHES.items():
+            row = []
+            for _, search, options in searches:
+                nodes = seconds = 0
+                for seed in range(seeds):
+                    random.seed(seed)
+                    problem = kakuro.Kakuro(kakuro.PUZZLES[name], **kwargs)
+                    start = perf_counter()
+                    search(problem, kakuro.bucket_mrv, inference=kakuro.forward_checking, **options)
+                    nodes, seconds = nodes + problem.nassigns, seconds + perf_counter() - start
+                row += [nodes, seconds]
+            print('{:<18}{:<20}'.format(name, label) + '{:>12}{:>10.3f}'.format(*row[:2])
+                  + '{:>12}{:>10.3f}'.format(*row[2:4]) + '{:>12}{:>10.3f}'.format(*row[4:])
+                  + '{:>8.0%}'.format(1 - row[2] / row[0]))
+
+
+# ______________________________________________________________________________
+# Restarts
+
+
+RESTART_SEARCHES = {
+    'BT': (kakuro.backtracking_search, {}),
+    'BT + luby': (kakuro.restart_search, dict(max_restarts=100)),
+    'CBJ': (kakuro.cbj_search, {}),
+    'CBJ + nogoods': (kakuro.cbj_search, dict(max_nogoods=1000)),
+    'CBJ + nogoods + luby': (kakuro.restart_search, dict(backjump=True, max_nogoods=1000)),
+    'CBJ + nogoods + geom': (kakuro.restart_search, dict(schedule='geometric', backjump=True, max_nogoods=1000)),
+}
+
+
+def percentile(values, p):
+    """Return the p-th percentile (0 to 100) of values, by nearest rank."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench_restarts(count=20, size=8, seeds=3):
+    """Distribution of the time to a first solution (nary FC + bucket_mrv) over count generated
+    size x size puzzles, each solved with seeds random seeds, with and without restarts
+    (the restarts of plain BT stop after 100 runs)."""
+    puzzles = [generator.generate(size, size, seed=n).grid for n in range(count)]
+    print('{:<24}{:>10}{:>10}{:>10}{:>10}{:>12}{:>10}'.format(
+        'search', 'p50 (s)', 'p90 (s)', 'p99 (s)', 'max (s)', 'assigns', 'unsolved'))
+    for label, (search, options) in RESTART_SEARCHES.items():
+        times, nodes, unsolved = [], 0, 0
+        for puzzle in puzzles:
+            for seed in range(seeds):
+                random.seed(seed)
+                problem = kakuro.Kakuro(puzzle, encoding='nary')
+                kwargs = dict(options, seed=seed) if search is kakuro.restart_search else options
+                start = perf_counter()
+                solution = search(problem, kakuro.bucket_mrv, inference=kakuro.forward_checking, **kwargs)
+                times.append(perf_counter() - start)
+                nodes += problem.nassigns
+                unsolved += solution is None
+        print('{:<24}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}{:>12}{:>10}'.format(
+            label, *(percentile(times, p) for p in (50, 90, 99, 100)), nodes, unsolved))
+
+
+# ______________________________________________________________________________
+# Local search
+
+
+LOCAL_SEARCHES = {'min_conflicts': kakuro.min_conflicts, 'incremental': kakuro.incremental_min_conflicts}
+
+
+def bench_min_conflicts(steps=500, seed=0):
+    """Steps per second of min_conflicts, which counts the conflicts of every variable at
+    each step, and incremental_min_conflicts, which keeps them up to date, over steps steps
+    (fewer if a solution turns up). The time of the initial assignment, a run with
+    max_steps=0 from the same seed, is taken off."""
+    print('{:<18}{:<10}{:>6}{:>20}{:>18}{:>10}'.format('puzzle', 'encoding', 'vars', 'min_conflicts (/s)',
+                                                      'incremental (/s)', 'speedup'))
+    for name in ('given5x7', 'hard8x8', 'given14x14'):
+        for encoding in ('hidden', 'nary'):
+            rates = []
+            for search in LOCAL_SEARCHES.values():
+                seconds = []
+                for max_steps in (0, steps):
+                    random.seed(seed)
+                    problem = kakuro.Kakuro(kakuro.PUZZLES[name], encoding=encoding)
+                    start = perf_counter()
+                    search(problem, max_steps=max_steps)
+                    seconds.append(perf_counter() - start)
+                rates.append((problem.nassigns - len(problem.variables)) / (seconds[1] - seconds[0]))
+            print('{:<18}{:<10}{:>6}{:>20.0f}{:>18.0f}{:>9.1f}x'.format(
+                name, encoding, len(problem.variables), *rates, rates[1] / rates[0]))
+
+
+LOCAL_SEARCH_VARIANTS = {
+    'greedy': dict(tenure=0, walk=0, max_plateau=0),
+    'plateau': dict(tenure=0, walk=0),
+    'tabu + plateau': dict(walk=0),
+    'tabu + walk': dict(),
+}
+
+
+def bench_local_search(seeds=3, seconds=1.0):
+    """tabu_search from seeds random starts, each given seconds seconds, with its moves
+    added one by one: only improving ones (greedy), plateau moves, tabu values, and random
+    walk steps (the defaults). Runs solved, mean conflicts of the best assignment and mean
+    seconds to a solution, over the solved runs."""
+    print('{:<18}{:<10}{:<16}{:>8}{:>11}{:>14}'.format('puzzle', 'encoding', 'moves', 'solved', 'conflicts',
+                                                       'to solve (s)'))
+    for name in ('hard8x8', 'given14x14'):
+        for encoding in ('hidden', 'nary'):
+            for label, kwargs in LOCAL_SEARCH_VARIANTS.items():
+                results = [local_search.tabu_search(kakuro.Kakuro(kakuro.PUZZLES[name], encoding=encoding),
+                                                    max_seconds=seconds, seed=seed, **kwargs)
+                           for seed in range(seeds)]
+                solved = [result.seconds for result in results if not result.conflicts]
+                print('{:<18}{:<10}{:<16}{:>8}{:>11.1f}{:>14}'.format(
+                    name, encoding, label, '{}/{}'.format(len(solved), seeds),
+                    sum(result.conflicts for result in results) / seeds,
+                    '{:.3f}'.format(sum(solved) / len(solved)) if solved else '-'))
+
+
+# ______________________________________________________________________________
+# Memory
+
+
+def peak_memory(fn, *args, **kwargs):
+    """Return the peak of the memory traced by tracemalloc, in bytes, while calling fn(*args, **kwargs)."""
+    tracemalloc.start()
+    try:
+        fn(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def build_and_solve(puzzle, cls=kakuro.Kakuro, **kwargs):
+    """Build cls(puzzle, **kwargs), a Kakuro, and solve it with BT + FC + MRV."""
+    problem = cls(puzzle, **kwargs)
+    kakuro.backtracking_search(problem, select_unassigned_variable=kakuro.mrv, inference=kakuro.forward_checking)
+
+
+def bench_memory():
+    """Peak traced memory of building and solving (BT + FC + MRV) each puzzle: with run permutations
+    as lists of strings, copied into the list domain store (before, LegacyKakuro), and packed into
+    arrays with table constraints and bitset domains (after)."""
+    print('{:<18}{:>14}{:>14}{:>10}'.format('puzzle', 'before (KiB)', 'after (KiB)', 'ratio'))
+    for name, puzzle in kakuro.PUZZLES.items():
+        with mock.patch.object(kakuro, 'run_domain', legacy_run_domain):
+            before = peak_memory(build_and_solve, puzzle, cls=LegacyKakuro)
+        kakuro.clear_tables()
+        after = peak_memory(build_and_solve, puzzle, bitmask=True)
+        print('{:<18}{:>14.1f}{:>14.1f}{:>9.1f}x'.format(name, before / 1024, after / 1024, before / after))
+
+
+# ______________________________________________________________________________
+# Import
+
+
+def bench_import(repeat=5):
+    """Cold-import time of kakuro in a fresh interpreter, net of the interpreter start-up."""
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def run(code):
+        subprocess.run([sys.executable, '-c', code], cwd=here, check=True)
+
+    startup = best_time(run, 'pass', repeat=repeat)
+    total = best_time(run, 'import kakuro', repeat=repeat)
+    print('{:<24}{:>10.4f}'.format('interpreter start-up (s)', startup))
+    print('{:<24}{:>10.4f}'.format('import kakuro (s)', total - startup))
+
+
+# ______________________________________________________________________________
+# Batch throughput
+
+
+def bench_throughput(copies=40, config=None):
+    """Puzzles per second of solve_many over a corpus of copies of each bundled puzzle, for
+    growing numbers of worker processes (0 solves in this process)."""
+    config = config or dict(encoding='nary', inference='sum')
+    puzzles = [(name, puzzle) for _ in range(copies) for name, puzzle in kakuro.PUZZLES.items()]
+    cores = os.cpu_count() or 1
+    counts = [0] + sorted({1, 2, 4, cores} & set(range(1, cores + 1)) | {cores})
+    print('{} puzzles, config {}, {} cores'.format(len(puzzles), config, cores))
+    print('{:>8}{:>12}{:>14}{:>10}'.format('workers', 'time (s)', 'puzzles/s', 'speedup'))
+    base = None
+    for workers in counts:
+        start = perf_counter()
+        results = list(batch.solve_many(puzzles, workers=workers, config=config))
+        seconds = perf_counter() - start
+        assert all(result.status == 'solved' for result in results)
+        if workers == 1:
+            base = seconds
+        print('{:>8}{:>12.3f}{:>14.1f}{:>10}'.format(workers, seconds, len(puzzles) / seconds,
+                                                     '{:.2f}x'.format(base / seconds) if base else ''))
+
+
+# ______________________________________________________________________________
+# Puzzle generation
+
+
+def bench_generation(count=12, sizes=((6, 6), (8, 8), (10, 10)), seed=0):
+    """Unique puzzles per minute of generate_many, for a few sizes and growing numbers of
+    worker processes (0 generates in this process). The same seed gives every run the same
+    puzzles."""
+    cores = os.cpu_count() or 1
+    counts = [0] + sorted({1, 2, 4, cores} & set(range(1, cores + 1)) | {cores})
+    print('{} puzzles per run, {} cores'.format(count, cores))
+    print('{:>8}{:>8}{:>12}{:>16}{:>14}'.format('size', 'workers', 'time (s)', 'puzzles/min', 'adjustments'))
+    for rows, cols in sizes:
+        for workers in counts:
+            start = perf_counter()
+            puzzles = list(generator.generate_many(count, rows, cols, seed=seed, workers=workers))
+            seconds = perf_counter() - start
+            print('{:>8}{:>8}{:>12.3f}{:>16.1f}{:>14.1f}'.format(
+                '{}x{}'.format(rows, cols), workers, seconds, 60 * count / seconds,
+                sum(puzzle.adjustments for puzzle in puzzles) / count))
+
+
+BENCHMARKS = {
+    'construction': bench_construction,
+    'constraint': bench_constraint,
+    'encodings': bench_encodings,
+    'propagation': bench_propagation,
+    'residues': bench_residues,
+    'arcqueue': bench_arc_queue,
+    'matrices': bench_matrices,
+    'undo': bench_undo,
+    'selection': bench_selection,
+    'iterative': bench_iterative,
+    'stats': bench_stats,
+    'wdeg': bench_wdeg,
+    'backjumping': bench_backjumping,
+    'restarts': bench_restarts,
+    'minconflicts': bench_min_conflicts,
+    'localsearch': bench_local_search,
+    'memory': bench_memory,
+    'import': bench_import,
+    'throughput': bench_throughput,
+    'generation': bench_generation,
+}
+
+
+def main(argv=None):
+    names = (sys.argv[1:] if argv is None else argv) or list(BENCHMARKS)
+    for name in names:
+        print('== {} ==\n'.format(name))
+        BENCHMARKS[name]()
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""Kakuro puzzle files.
+
+A puzzle file holds one puzzle per line, in either of two formats (they can be mixed):
+
+    text:   [name:] row / row / ...
+            where each row is whitespace-separated cells: '*' for a black cell, '_' for an
+            empty cell and 'D\\R' for a clue cell with down sum D and right sum R, either of
+            which may be left out (e.g. '17\\', '\\9', '31\\14').
+    JSON:   {"name": ..., "grid": [[...], ...]}
+            where grid is a puzzle in the list form Kakuro takes, e.g. ['*', [17, ''], '_'].
+
+Blank lines and lines starting with '#' are ignored. The name is optional in both formats.
+
+iter_puzzles streams the puzzles of a file one line at a time; PuzzleCorpus memory-maps a
+file and keeps an index of line offsets, so that puzzle n is read in O(1).
+"""
+
+import json
+import mmap
+import os
+from array import array
+
+
+# ______________________________________________________________________________
+# Parsing and formatting
+
+
+def parse_cell(token):
+    """Return the Kakuro grid cell written as token in the text format."""
+    if token in ('*', '_'):
+        return token
+    down, sep, right = token.partition('\\')
+    if not sep:
+        raise ValueError('bad cell: {!r}'.format(token))
+    try:
+        return [int(down) if down else '', int(right) if right else '']
+    except ValueError:
+        raise ValueError('bad cell: {!r}'.format(token)) from None
+
+
+def format_cell(cell):
+    """Return the text format of a Kakuro grid cell."""
+    if cell in ('*', '_'):
+        return cell
+    return '{}\\{}'.format(*cell)
+
+
+def parse_puzzle(line):
+    """Parse one line of a puzzle file into (name, grid); name is None if the line has none."""
+    line = line.strip()
+    if line.startswith('{'):
+        record = json.loads(line)
+        return record.get('name'), record['grid']
+    name, sep, rows = line.rpartition(':')
+    grid = [[parse_cell(token) for token in row.split()] for row in rows.split('/')]
+    if not all(grid):
+        raise ValueError('empty row in puzzle {!r}'.format(line))
+    return (name.strip() or None) if sep else None, grid
+
+
+def format_puzzle(grid, name=None, fmt='text'):
+    """Return a puzzle as one line (without newline) of a puzzle file in format fmt, 'text' or 'json'."""
+    if fmt == 'json':
+        record = {'grid': grid} if name is None else {'name': name, 'grid': grid}
+        return json.dumps(record, separators=(',', ':'))
+    rows = ' / '.join(' '.join(format_cell(cell) for cell in row) for row in grid)
+    return rows if name is None else '{}: {}'.format(name, rows)
+
+
+def is_puzzle_line(line):
+    """Is this line of a puzzle file (str or bytes) a puzzle, rather than blank or a comment?"""
+    line = line.strip()
+    return bool(line) and line[:1] not in ('#', b'#')
+
+
+# ______________________________________________________________________________
+# Reading and writing files
+
+
+def iter_puzzles(source):
+    """Yield (name, grid) for each puzzle of source, a path or an open text file, reading
+    one line at a time."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding='utf-8') as f:
+            yield from iter_puzzles(f)
+        return
+    for number, line in enumerate(source, 1):
+        if is_puzzle_line(line):
+            try:
+                yield parse_puzzle(line)
+            except (ValueError, KeyError) as e:
+                raise ValueError('line {}: {}'.format(number, e)) from e
+
+
+def write_puzzles(path, puzzles, fmt='text'):
+    """Write puzzles, an iterable of (name, grid), to a puzzle file in format fmt."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for name, grid in puzzles:
+            f.write(format_puzzle(grid, name, fmt) + '\n')
+
+
+class PuzzleCorpus:
+    """A memory-mapped puzzle file with random access: corpus[n] parses only the n-th puzzle.
+
+    The index is an array of the byte offsets of the puzzle lines, built in one pass over the
+    file, or loaded from index_path if that file is newer than the corpus. save_index writes it
+    there for later runs.
+
+    >>> with PuzzleCorpus('puzzles.txt') as corpus:   # doctest: +SKIP
+    ...     name, grid = corpus[12345]
+    """
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or str(path) + '.idx'
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.offsets = self.load_index() or self.build_index()
+
+    def build_index(self):
+        """Return the offsets of the puzzle lines, with the file size appended."""
+        offsets = array('Q')
+        start, size = 0, len(self.data)
+        while start < size:
+            end = self.data.find(b'\n', start)
+            if end < 0:
+                end = size
+            if is_puzzle_line(self.data[start:end]):
+                offsets.append(start)
+            start = end + 1
+        offsets.append(size)
+        return offsets
+
+    def load_index(self):
+        """Return the offsets saved at index_path, or None if missing, corrupt or older than the corpus."""
+        try:
+            if os.path.getmtime(self.index_path) < os.path.getmtime(self.path):
+                return None
+            offsets = array('Q')
+            with open(self.index_path, 'rb') as f:
+                offsets.frombytes(f.read())
+        except (OSError, ValueError):  # ValueError: truncated to a partial offset
+            return None
+        return offsets if offsets and offsets[-1] == len(self.data) else None
+
+    def save_index(self):
+        """Write the offsets to index_path."""
+        with open(self.index_path, 'wb') as f:
+            self.offsets.tofile(f)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def line(self, n):
+        """Return the n-th puzzle line, as text."""
+        if not -len(self) <= n < len(self):
+            raise IndexError('puzzle index out of range')
+        n %= len(self)
+        start = self.offsets[n]
+        end = self.data.find(b'\n', start, self.offsets[n + 1])
+        return self.data[start:end if end >= 0 else self.offsets[n + 1]].decode('utf-8')
+
+    def __getitem__(self, n):
+        return parse_puzzle(self.line(n))
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,11 +1,22 @@
 
 
+import copy
+import json
 import random
-from collections import defaultdict, Counter
+from collections import defaultdict, deque, Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from heapq import heapify, heappop, heappush
+from itertools import chain, repeat
 from operator import eq, neg
+from time import perf_counter
 
 from sortedcontainers import SortedSet
 
+try:
+    import numpy as np
+except ImportError:  # Only CompatibilityMatrices needs it
+    np = None
+
 import search
 from utils import argmin_random_tie, count, first, extend
 
@@ -22,11 +33,21 @@ class CSP(search.Problem):
         self.constraints = constraints
         self.curr_domains = None
         self.nassigns = 0
+        self.nbackjumps = 0  # Assigned variables cbj_search jumped back over
+        self.nrestarts = 0  # Runs restart_search cut off and started over
+        self.buckets = None  # The DomainBuckets of bucket_mrv, if it is used
+        self.weights = Counter()  # {(A, B): wipeouts} of the constraint between neighbors A and B, for dom_wdeg
+        self.last_wipeout = None  # The variable whose domain was last emptied
+        self.residues = {}  # {(Xi, x, Xj): the value of Xj last found to support Xi=x}, for AC3rm
+        self.stats = None  # A SearchStats to record the searches into, or None not to record them
+        self.matrices = None  # CompatibilityMatrices to revise arcs and forward check with, or None
 
     def assign(self, var, val, assignment):
         """Add {var: val} to assignment; Discard the old value if any."""
         assignment[var] = val
         self.nassigns += 1
+        if self.buckets is not None:
+            self.buckets.discard(var)
 
     def unassign(self, var, assignment):
         """Remove {var: val} from assignment.
@@ -34,6 +55,8 @@ class CSP(search.Problem):
         just call assign for that."""
         if var in assignment:
             del assignment[var]
+            if self.buckets is not None:
+                self.buckets.add(var, self.domain_size(var))
 
     def nconflicts(self, var, val, assignment):
         """Return the number of conflicts var=val has with other variables."""
@@ -75,40 +98,131 @@ class CSP(search.Problem):
                         for variables in self.variables))
 
     # These are for constraint propagation
+    # The current domain of each variable is a bitset over the indices of its domain, so pruning
+    # is O(1) and the values left always come out in domain order. Every change is pushed on one
+    # trail of (var, bits removed) entries shared by the whole search: suppose marks the depth
+    # of the trail and returns the trail itself as removals, and restore pops it back to the
+    # last mark, in time proportional to the changes undone.
 
     def support_pruning(self):
         """Make sure we can prune values from domains. (We want to pay
         for this only if we use it.)"""
         if self.curr_domains is None:
-            self.curr_domains = {v: list(self.domains[v]) for v in self.variables}
+            self.curr_domains = {v: self.domain_bits(v) for v in self.variables}
+            self.value_ids = {}
+            self.trail = []
+            self.marks = []
+            self.trail_floor = 0  # The lowest depth the trail was popped back to since bucket_mrv last looked
+
+    def domain_bits(self, var):
+        """Return the bitset of the full domain of var."""
+        return (1 << len(self.domains[var])) - 1
+
+    def bit_values(self, var):
+        """Return the values of var by bit of its domain bitset: bit i stands for entry i."""
+        return self.domains[var]
+
+    def value_bit(self, var, value):
+        """Return the bit of value in the current domain of var."""
+        ids = self.value_ids.get(var)
+        if ids is None:
+            ids = self.value_ids[var] = {x: i for i, x in enumerate(self.domains[var])}
+        return 1 << ids[value]
 
     def suppose(self, var, value):
         """Start accumulating inferences from assuming var=value."""
         self.support_pruning()
-        removals = [(var, a) for a in self.curr_domains[var] if a != value]
-        self.curr_domains[var] = [value]
-        return removals
+        self.marks.append(len(self.trail))
+        bit = self.value_bit(var, value)
+        removed = self.curr_domains[var] & ~bit
+        if removed:
+            self.trail.append((var, removed))
+        self.curr_domains[var] = bit
+        return self.trail
 
     def prune(self, var, value, removals):
         """Rule out var=value."""
-        self.curr_domains[var].remove(value)
-        if removals is not None:
-            removals.append((var, value))
+        bit = self.value_bit(var, value)
+        if self.curr_domains[var] & bit:
+            self.curr_domains[var] ^= bit
+            if removals is not None:
+                removals.append((var, bit))
 
     def choices(self, var):
         """Return all values for var that aren't currently ruled out."""
-        return (self.curr_domains or self.domains)[var]
+        if not self.curr_domains:
+            return self.domains[var]
+        domain = self.domains[var]
+        return [domain[i] for i in bitset_indices(self.curr_domains[var])]
+
+    def domain_size(self, var):
+        """Return the number of values for var that aren't currently ruled out."""
+        if not self.curr_domains:
+            return len(self.domains[var])
+        return bin(self.curr_domains[var]).count('1')
+
+    def compatibility_matrix(self, A, B):
+        """Return the boolean matrix of the constraint between A and B, indexed by the bits of
+        their domain bitsets (see bit_values): entry [i, j] is whether A and B can take the
+        values of bits i and j together. Needs numpy."""
+        B_values = self.bit_values(B)
+        return np.array([[self.constraints(A, a, B, b) for b in B_values] for a in self.bit_values(A)],
+                        dtype=bool).reshape(-1, len(B_values))
+
+    def forward_check(self, var, value, B, removals):
+        """Prune the values of B inconsistent with var=value.
+        Return False if B is left with no values."""
+        if self.matrices is not None:
+            if self.stats is not None:
+                self.stats.checks += self.curr_domains[B].bit_count()  # The row entries looked at
+            removed = self.curr_domains[B] & ~self.matrices.supports(self, var, value, B)
+            if removed:
+                self.curr_domains[B] ^= removed
+                if removals is not None:
+                    removals.append((B, removed))
+            return self.curr_domains[B] != 0
+        removed = 0
+        values = self.choices(B)
+        for b in values:
+            if not self.constraints(var, value, B, b):
+                removed |= self.value_bit(B, b)
+        if self.stats is not None:
+            self.stats.checks += len(values)
+        if removed:
+            self.curr_domains[B] ^= removed
+            if removals is not None:
+                removals.append((B, removed))
+        return self.curr_domains[B] != 0
 
     def infer_assignment(self):
         """Return the partial assignment implied by the current inferences."""
         self.support_pruning()
-        return {v: self.curr_domains[v][0]
-                for v in self.variables if 1 == len(self.curr_domains[v])}
+        return {v: self.choices(v)[0]
+                for v in self.variables if 1 == self.domain_size(v)}
 
     def restore(self, removals):
-        """Undo a supposition and all inferences from it."""
-        for B, b in removals:
-            self.curr_domains[B].append(b)
+        """Undo a supposition and all inferences from it: pop the trail, removals, back to
+        the depth it had when the matching suppose was called."""
+        mark = self.marks.pop()
+        if mark < self.trail_floor:
+            self.trail_floor = mark
+        domains = self.curr_domains
+        while len(removals) > mark:
+            B, b = removals.pop()
+            domains[B] |= b
+
+    def record_wipeout(self, var, other):
+        """Note that propagating the constraint between var and other emptied the domain of var:
+        bump the weight of that constraint, kept under both (var, other) and (other, var)."""
+        self.last_wipeout = var
+        self.weights[var, other] += 1
+        self.weights[other, var] += 1
+
+    def constraint_weights(self):
+        """Return {(A, B): wipeouts} with one entry per constraint that caused any, A coming
+        before B in variables. Weights add up over every search run on this CSP."""
+        order = {var: i for i, var in enumerate(self.variables)}
+        return {(A, B): w for (A, B), w in self.weights.items() if order[A] < order[B]}
 
     # This is for min_conflicts search
 
@@ -117,6 +231,30 @@ class CSP(search.Problem):
         return [var for var in self.variables
                 if self.nconflicts(var, current[var], current) > 0]
 
+    def value_conflicts(self, var, current):
+        """Return the conflicts with current of each value of var, in domain order."""
+        return [self.nconflicts(var, val, current) for val in self.domains[var]]
+
+    def min_conflict_values(self, var, current):
+        """Return the values of var with the fewest conflicts with current, in domain order."""
+        counts = self.value_conflicts(var, current)
+        fewest = min(counts)
+        return [val for val, n in zip(self.domains[var], counts) if n == fewest]
+
+
+def bitset_indices(bits):
+    """Return the list of the indices of the set bits of bits, in increasing order."""
+    digits = bin(bits)
+    if 8 * digits.count('1') > len(digits):
+        return [i for i, bit in enumerate(reversed(digits)) if bit == '1']
+    # Sparse: step from one set bit to the next
+    indices = []
+    while bits:
+        low = bits & -bits
+        indices.append(low.bit_length() - 1)
+        bits ^= low
+    return indices
+
 
 # ______________________________________________________________________________
 # Constraint Propagation with AC3
@@ -127,10 +265,83 @@ def no_arc_heuristic(csp, queue):
 
 
 def dom_j_up(csp, queue):
-    return SortedSet(queue, key=lambda t: neg(len(csp.curr_domains[t[1]])))
+    return SortedSet(queue, key=lambda t: neg(csp.domain_size(t[1])))
+
+
+def dom_j_buckets(csp, queue):
+    return ArcQueue(csp, queue)
+
+
+class ArcQueue:
+    """A queue of arcs (Xi, Xj) that pops the arc whose Xj has the smallest current domain,
+    as dom_j_up does, for the arc queues of AC3, AC3b and AC3rm.
+
+    Arcs sit in buckets by the domain size of Xj when they were added, with a heap of the
+    bucket sizes, so building the queue is linear and adding an arc is O(1) (plus a heap push
+    for a new size). Domains only shrink during a propagation, so an arc can only be in too
+    high a bucket: pop checks the domain of Xj again and moves the arc down if it shrank,
+    so the order is that of the current domains, not those of when the arcs were added.
+    queued maps each arc in the queue to its bucket, for O(1) membership and discard;
+    discarded and moved arcs are left in their old bucket and skipped when popped."""
+
+    def __init__(self, csp, arcs=()):
+        self.csp = csp
+        self.buckets = buckets = {}  # {size: [arcs]}
+        self.queued = queued = {}  # {arc: size of its bucket}
+        domain_size = csp.domain_size
+        for arc in arcs:
+            if arc not in queued:
+                size = queued[arc] = domain_size(arc[1])
+                if size in buckets:
+                    buckets[size].append(arc)
+                else:
+                    buckets[size] = [arc]
+        self.sizes = list(buckets)  # The keys of buckets, as a heap
+        heapify(self.sizes)
+
+    def __len__(self):
+        return len(self.queued)
+
+    def __contains__(self, arc):
+        return arc in self.queued
+
+    def add(self, arc):
+        if arc not in self.queued:
+            self.push(arc, self.csp.domain_size(arc[1]))
+
+    def push(self, arc, size):
+        self.queued[arc] = size
+        bucket = self.buckets.get(size)
+        if bucket is None:
+            bucket = self.buckets[size] = []
+            heappush(self.sizes, size)
+        bucket.append(arc)
+
+    def discard(self, arc):
+        self.queued.pop(arc, None)
+
+    def pop(self):
+        """Remove and return the arc whose Xj has the smallest current domain."""
+        queued = self.queued
+        while True:
+            size = self.sizes[0]
+            bucket = self.buckets[size]
+            while bucket:
+                arc = bucket.pop()
+                if queued.get(arc) != size:
+                    continue  # Discarded, or moved to another bucket
+                current = self.csp.domain_size(arc[1])
+                if current < size:
+                    self.push(arc, current)
+                    break
+                del queued[arc]
+                return arc
+            else:
+                heappop(self.sizes)
+                del self.buckets[size]
 
 
-def AC3(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
+def AC3(csp, queue=None, removals=None, arc_heuristic=dom_j_buckets):
     """[Figure 6.3]"""
     if queue is None:
         queue = {(Xi, Xk) for Xi in csp.variables for Xk in csp.neighbors[Xi]}
@@ -141,7 +352,8 @@ def AC3(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
         (Xi, Xj) = queue.pop()
         revised, checks = revise(csp, Xi, Xj, removals, checks)
         if revised:
-            if not csp.curr_domains[Xi]:
+            if not csp.choices(Xi):
+                csp.record_wipeout(Xi, Xj)
                 return False, checks  # CSP is inconsistent
             for Xk in csp.neighbors[Xi]:
                 if Xk != Xj:
@@ -151,12 +363,15 @@ def AC3(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
 
 def revise(csp, Xi, Xj, removals, checks=0):
     """Return true if we remove a value."""
+    if csp.matrices is not None:
+        return csp.matrices.revise(csp, Xi, Xj, removals, checks)
     revised = False
-    for x in csp.curr_domains[Xi][:]:
+    Xj_values = csp.choices(Xj)  # Only Xi is pruned here
+    for x in csp.choices(Xi)[:]:
         # If Xi=x conflicts with Xj=y for every possible y, eliminate Xi=x
         # if all(not csp.constraints(Xi, x, Xj, y) for y in csp.curr_domains[Xj]):
         conflict = True
-        for y in csp.curr_domains[Xj]:
+        for y in Xj_values:
             if csp.constraints(Xi, x, Xj, y):
                 conflict = False
             checks += 1
@@ -168,10 +383,62 @@ def revise(csp, Xi, Xj, removals, checks=0):
     return revised, checks
 
 
+# Constraint Propagation with AC3rm: AC3 with residual supports
+# Each time revise finds a support y of Xi=x in Xj, it is kept as the residue of (Xi, x, Xj),
+# and, as constraints go both ways, x as the residue of (Xj, y, Xi). A later revision of the
+# arc first tests whether the residue is still in the domain of Xj, a bit test rather than a
+# constraint check, and only looks for a new support if it is gone. Residues are never undone
+# on backtracking: a stale one just fails the domain test.
+
+def AC3rm(csp, queue=None, removals=None, arc_heuristic=dom_j_buckets):
+    if queue is None:
+        queue = {(Xi, Xk) for Xi in csp.variables for Xk in csp.neighbors[Xi]}
+    csp.support_pruning()
+    queue = arc_heuristic(csp, queue)
+    checks = 0
+    while queue:
+        (Xi, Xj) = queue.pop()
+        revised, checks = revise_rm(csp, Xi, Xj, removals, checks)
+        if revised:
+            if not csp.choices(Xi):
+                csp.record_wipeout(Xi, Xj)
+                return False, checks  # CSP is inconsistent
+            for Xk in csp.neighbors[Xi]:
+                if Xk != Xj:
+                    queue.add((Xk, Xi))
+    return True, checks  # CSP is satisfiable
+
+
+def revise_rm(csp, Xi, Xj, removals, checks=0):
+    """revise, trying the residue of each value before searching Xj for a support.
+    checks counts constraint checks only, not residue tests."""
+    residues = csp.residues
+    Dj, value_bit = csp.curr_domains[Xj], csp.value_bit  # Only Xi is pruned here
+    revised = False
+    Xj_values = None  # Only decoded if some residue is gone
+    for x in csp.choices(Xi):
+        residue = (Xi, x, Xj)
+        y = residues.get(residue, residues)  # residues itself stands for no residue
+        if y is not residues and Dj & value_bit(Xj, y):
+            continue
+        if Xj_values is None:
+            Xj_values = csp.choices(Xj)
+        for y in Xj_values:
+            checks += 1
+            if csp.constraints(Xi, x, Xj, y):
+                residues[residue] = y
+                residues[Xj, y, Xi] = x
+                break
+        else:
+            csp.prune(Xi, x, removals)
+            revised = True
+    return revised, checks
+
+
 # Constraint Propagation with AC3b: an improved version
 # of AC3 with double-support domain-heuristic
 
-def AC3b(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
+def AC3b(csp, queue=None, removals=None, arc_heuristic=dom_j_buckets):
     if queue is None:
         queue = {(Xi, Xk) for Xi in csp.variables for Xk in csp.neighbors[Xi]}
     csp.support_pruning()
@@ -179,14 +446,32 @@ def AC3b(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
     checks = 0
     while queue:
         (Xi, Xj) = queue.pop()
+        if csp.matrices is not None:
+            # With compatibility matrices, double-support checks save nothing: revise Xi, then
+            # Xj if (Xj, Xi) is queued, each in one vectorized step
+            arcs = [(Xi, Xj)]
+            if (Xj, Xi) in queue:
+                drop_arc(queue, (Xj, Xi))
+                arcs.append((Xj, Xi))
+            for Xa, Xb in arcs:
+                revised, checks = csp.matrices.revise(csp, Xa, Xb, removals, checks)
+                if revised:
+                    if not csp.curr_domains[Xa]:
+                        csp.record_wipeout(Xa, Xb)
+                        return False, checks  # CSP is inconsistent
+                    for Xk in csp.neighbors[Xa]:
+                        if Xk != Xb:
+                            queue.add((Xk, Xa))
+            continue
         # Si_p values are all known to be supported by Xj
         # Sj_p values are all known to be supported by Xi
         # Dj - Sj_p = Sj_u values are unknown, as yet, to be supported by Xi
         Si_p, Sj_p, Sj_u, checks = partition(csp, Xi, Xj, checks)
         if not Si_p:
+            csp.record_wipeout(Xi, Xj)
             return False, checks  # CSP is inconsistent
         revised = False
-        for x in set(csp.curr_domains[Xi]) - Si_p:
+        for x in set(csp.choices(Xi)) - Si_p:
             csp.prune(Xi, x, removals)
             revised = True
         if revised:
@@ -194,11 +479,7 @@ def AC3b(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
                 if Xk != Xj:
                     queue.add((Xk, Xi))
         if (Xj, Xi) in queue:
-            if isinstance(queue, set):
-                # or queue -= {(Xj, Xi)} or queue.remove((Xj, Xi))
-                queue.difference_update({(Xj, Xi)})
-            else:
-                queue.difference_update((Xj, Xi))
+            drop_arc(queue, (Xj, Xi))
             # the elements in D_j which are supported by Xi are given by the union of Sj_p with the set of those
             # elements of Sj_u which further processing will show to be supported by some vi_p in Si_p
             for vj_p in Sj_u:
@@ -211,9 +492,12 @@ def AC3b(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
                     if not conflict:
                         break
             revised = False
-            for x in set(csp.curr_domains[Xj]) - Sj_p:
+            for x in set(csp.choices(Xj)) - Sj_p:
                 csp.prune(Xj, x, removals)
                 revised = True
+            if not Sj_p:
+                csp.record_wipeout(Xj, Xi)
+                return False, checks  # CSP is inconsistent
             if revised:
                 for Xk in csp.neighbors[Xj]:
                     if Xk != Xi:
@@ -221,11 +505,22 @@ def AC3b(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
     return True, checks  # CSP is satisfiable
 
 
+def drop_arc(queue, arc):
+    """Remove arc, which must be in it, from the arc queue of AC3b."""
+    if not isinstance(queue, SortedSet):
+        # or queue -= {arc} or queue.remove(arc)
+        queue.discard(arc)
+    else:
+        # The key of arc may have changed since it was added, so SortedSet cannot look it
+        # up to remove it: find it by a linear scan
+        del queue[next(i for i, queued in enumerate(queue) if queued == arc)]
+
+
 def partition(csp, Xi, Xj, checks=0):
     Si_p = set()
     Sj_p = set()
-    Sj_u = set(csp.curr_domains[Xj])
-    for vi_u in csp.curr_domains[Xi]:
+    Sj_u = set(csp.choices(Xj))
+    for vi_u in csp.choices(Xi):
         conflict = True
         # now, in order to establish support for a value vi_u in Di it seems better to try to find a support among
         # the values in Sj_u first, because for each vj_u in Sj_u the check (vi_u, vj_u) is a double-support check
@@ -253,6 +548,97 @@ def partition(csp, Xi, Xj, checks=0):
     return Si_p, Sj_p, Sj_u - Sj_p, checks
 
 
+# Compatibility matrices: opt-in vectorized revision with numpy
+# csp.matrices = CompatibilityMatrices() has revise (so AC3), AC3b and forward checking
+# work on the boolean matrix of each constraint, over the bits of the domain bitsets, instead
+# of calling csp.constraints pair by pair. Each row of a matrix, the values of Xj compatible
+# with a value of Xi, is packed into 64-bit words laid out as the domain bitset of Xj, so a
+# revision keeps the values of Xi (the rows its boolean mask selects) whose row has any bit
+# in common with the current domain of Xj. Its cost grows with the product of the domain
+# sizes, as a word-wide AND at numpy speed, so it pays off on large domains and tight
+# constraints (see bench_matrices). Constraints must be symmetric, as AC3b has them, and
+# fixed: a CSP whose constraints or domains change needs its matrices cleared.
+
+class CompatibilityMatrices:
+    """A cache of the compatibility matrices of the arcs of a CSP, built on first use by
+    csp.compatibility_matrix, with their rows packed into words for revise and into bitsets
+    for forward checking. It only depends on the constraints, so the copies of component_csp
+    share it."""
+
+    def __init__(self):
+        if np is None:
+            raise ImportError('CompatibilityMatrices needs numpy')
+        self.matrices = {}  # {(A, B): compatibility matrix of the arc}, the transpose for (B, A)
+        self.words = {}  # {(A, B): the rows of the matrix of (A, B) as arrays of 64-bit words}
+        self.rows = {}  # {(A, B): [bitset of the values of B compatible with bit i of A]}
+
+    def clear(self):
+        self.matrices.clear()
+        self.words.clear()
+        self.rows.clear()
+
+    def matrix(self, csp, A, B):
+        """Return the compatibility matrix of the arc (A, B)."""
+        matrix = self.matrices.get((A, B))
+        if matrix is None:
+            matrix = self.matrices[A, B] = csp.compatibility_matrix(A, B)
+            self.matrices[B, A] = matrix.T
+        return matrix
+
+    def row_words(self, csp, A, B):
+        """Return the rows of the matrix of (A, B) packed little-endian into 64-bit words,
+        bit j of row i standing for entry [i, j], as the bitsets of the domain of B."""
+        words = self.words.get((A, B))
+        if words is None:
+            packed = np.packbits(self.matrix(csp, A, B), axis=1, bitorder='little')
+            padded = np.zeros((packed.shape[0], -(-packed.shape[1] // 8) * 8), dtype=np.uint8)
+            padded[:, :packed.shape[1]] = packed
+            words = self.words[A, B] = padded.view('<u8')
+        return words
+
+    def supports(self, csp, var, value, B):
+        """Return the bitset of the values of B compatible with var=value."""
+        rows = self.rows.get((var, B))
+        if rows is None:
+            rows = self.rows[var, B] = [int.from_bytes(row.tobytes(), 'little')
+                                        for row in self.row_words(csp, var, B)]
+        return rows[csp.value_bit(var, value).bit_length() - 1]
+
+    def revise(self, csp, Xi, Xj, removals, checks=0):
+        """revise with the compatibility matrix of (Xi, Xj). checks counts the entries of the
+        matrix looked at: the values of Xi times those of Xj."""
+        words = self.row_words(csp, Xi, Xj)
+        Di = bitset_mask(csp.curr_domains[Xi], words.shape[0])
+        Dj = csp.curr_domains[Xj]
+        rows = np.flatnonzero(Di)
+        supported = (words[rows] & bitset_words(Dj, words.shape[1])).any(axis=1)
+        checks += len(rows) * Dj.bit_count()
+        if supported.all():
+            return False, checks
+        Di[rows[supported]] = False
+        removed = mask_bitset(Di)
+        csp.curr_domains[Xi] ^= removed
+        if removals is not None:
+            removals.append((Xi, removed))
+        return True, checks
+
+
+def bitset_mask(bits, n):
+    """Return the boolean mask of the first n bits of bits."""
+    return np.unpackbits(np.frombuffer(bits.to_bytes((n + 7) // 8, 'little'), dtype=np.uint8),
+                         count=n, bitorder='little').view(bool)
+
+
+def bitset_words(bits, n):
+    """Return bits as n little-endian 64-bit words."""
+    return np.frombuffer(bits.to_bytes(8 * n, 'little'), dtype='<u8')
+
+
+def mask_bitset(mask):
+    """Return the bitset of a boolean mask."""
+    return int.from_bytes(np.packbits(mask, bitorder='little').tobytes(), 'little')
+
+
 # ______________________________________________________________________________
 # CSP Backtracking Search
 
@@ -270,9 +656,100 @@ def mrv(assignment, csp):
                              key=lambda var: num_legal_values(csp, var, assignment))
 
 
+class DomainBuckets:
+    """The unassigned variables of a CSP bucketed by current domain size, for bucket_mrv.
+
+    Each bucket is a list with the position of every variable in it, so that a variable moves
+    between buckets in O(1) and a random one is drawn from a bucket without shuffling. The
+    sizes are brought up to date from the trail: the variables of the entries pushed since the
+    last sync, and of those popped since, are the only ones whose domains changed. assign and
+    unassign take variables out and put them back. Domain changes left off the trail
+    (removals=None) after the buckets are built are not seen."""
+
+    def __init__(self, csp, assignment):
+        self.domains = csp.curr_domains  # The buckets are for this curr_domains only
+        self.size = {}  # {var: domain size} of the variables in the buckets
+        self.buckets = {}  # {domain size: [var, ...]}, without empty buckets
+        self.position = {}  # {var: index of var in its bucket}
+        self.trail_vars = [var for var, _ in csp.trail]  # The var of each trail entry seen
+        csp.trail_floor = len(csp.trail)
+        for var in csp.variables:
+            if var not in assignment:
+                self.add(var, csp.domain_size(var))
+
+    def add(self, var, size):
+        """Put var in the bucket of size, moving it if it is in another one."""
+        old = self.size.get(var)
+        if old == size:
+            return
+        if old is not None:
+            self.discard(var)
+        bucket = self.buckets.setdefault(size, [])
+        self.size[var] = size
+        self.position[var] = len(bucket)
+        bucket.append(var)
+
+    def discard(self, var):
+        """Take var out of its bucket, if it is in one."""
+        size = self.size.pop(var, None)
+        if size is None:
+            return
+        bucket = self.buckets[size]
+        i = self.position.pop(var)
+        last = bucket.pop()
+        if last != var:
+            bucket[i] = last
+            self.position[last] = i
+        if not bucket:
+            del self.buckets[size]
+
+    def sync(self, csp):
+        """Move the variables whose domains changed on the trail since the last sync."""
+        trail = csp.trail
+        floor = min(csp.trail_floor, len(self.trail_vars))
+        changed = self.trail_vars[floor:]  # Popped since, and maybe pushed again
+        del self.trail_vars[floor:]
+        for i in range(floor, len(trail)):
+            self.trail_vars.append(trail[i][0])
+        changed += self.trail_vars[floor:]
+        csp.trail_floor = len(trail)
+        for var in changed:
+            if var in self.size:
+                self.add(var, csp.domain_size(var))
+
+    def smallest(self):
+        """Return a random variable of the smallest domain size."""
+        return random.choice(self.buckets[min(self.buckets)])
+
+
+def bucket_mrv(assignment, csp):
+    """Minimum-remaining-values heuristic over current domains, kept incrementally in
+    DomainBuckets instead of rescanning every variable at each node. Ties are broken at random."""
+    csp.support_pruning()
+    buckets = csp.buckets
+    if buckets is None or buckets.domains is not csp.curr_domains:
+        buckets = csp.buckets = DomainBuckets(csp, assignment)
+    else:
+        buckets.sync(csp)
+    return buckets.smallest()
+
+
+def dom_wdeg(assignment, csp):
+    """Conflict-directed variable ordering: the variable with the smallest ratio of current
+    domain size to weighted degree, the summed weights of its constraints with unassigned
+    variables. A constraint weighs 1 plus the domain wipeouts it caused so far (csp.weights),
+    so the search turns to the variables of the constraints that keep failing."""
+
+    def ratio(var):
+        wdeg = sum(1 + csp.weights[var, other] for other in csp.neighbors[var] if other not in assignment)
+        return csp.domain_size(var) / wdeg if wdeg else float('inf')
+
+    return argmin_random_tie([v for v in csp.variables if v not in assignment], key=ratio)
+
+
 def num_legal_values(csp, var, assignment):
     if csp.curr_domains:
-        return len(csp.curr_domains[var])
+        return csp.domain_size(var)
     else:
         return count(csp.nconflicts(var, val, assignment) == 0 for val in csp.domains[var])
 
@@ -285,6 +762,11 @@ def unordered_domain_values(var, assignment, csp):
     return csp.choices(var)
 
 
+def shuffled_domain_values(var, assignment, csp):
+    """The values of var in random order, for randomized restarts."""
+    return random.sample(csp.choices(var), csp.domain_size(var))
+
+
 def lcv(var, assignment, csp):
     """Least-constraining-values heuristic."""
     return sorted(csp.choices(var), key=lambda val: csp.nconflicts(var, val, assignment))
@@ -302,17 +784,111 @@ def forward_checking(csp, var, value, assignment, removals):
     csp.support_pruning()
     for B in csp.neighbors[var]:
         if B not in assignment:
-            for b in csp.curr_domains[B][:]:
-                if not csp.constraints(var, value, B, b):
-                    csp.prune(B, b, removals)
-            if not csp.curr_domains[B]:
+            if not csp.forward_check(var, value, B, removals):
+                csp.record_wipeout(B, var)
                 return False
     return True
 
 
 def mac(csp, var, value, assignment, removals, constraint_propagation=AC3b):
-    """Maintain arc consistency."""
-    return constraint_propagation(csp, {(X, var) for X in csp.neighbors[var]}, removals)
+    """Maintain arc consistency. Return whether the domains are still consistent; the
+    constraint checks of constraint_propagation go to csp.stats, if it records them."""
+    consistent, checks = constraint_propagation(csp, {(X, var) for X in csp.neighbors[var]}, removals)
+    if csp.stats is not None:
+        csp.stats.checks += checks
+    return consistent
+
+
+# Search statistics
+
+
+class SearchStats:
+    """What the searches of a CSP did, recorded while csp.stats is a SearchStats:
+
+    >>> csp.stats = SearchStats()                                          # doctest: +SKIP
+    >>> backtracking_search(csp, mrv, inference=forward_checking)          # doctest: +SKIP
+    >>> csp.stats.to_json()                                                # doctest: +SKIP
+
+    The searches record through instrumented heuristics, so with csp.stats None (the
+    default) they run the heuristics as given, at no cost. Counts add up over every search
+    run on the CSP until csp.stats is replaced."""
+
+    def __init__(self):
+        self.assignments = 0
+        self.backtracks = 0  # Variables whose values were all tried and failed
+        self.checks = 0  # Constraint checks of forward_check, of the propagation of mac and of
+        # sum_propagation; a check on a bitset counts one per value it tests
+        self.max_depth = 0  # The most variables assigned at once
+        self.prunings = Counter()  # {var: values inference pruned from var}
+        self.wipeouts = Counter()  # {var: inferences that failed by emptying the domain of var}
+        self.select_seconds = 0.0  # Time spent in select_unassigned_variable
+        self.order_seconds = 0.0  # ... in order_domain_values, up to returning its values
+        self.inference_seconds = 0.0  # ... in inference
+
+    def update(self, other):
+        """Add the counts of other, another SearchStats, to these."""
+        self.assignments += other.assignments
+        self.backtracks += other.backtracks
+        self.checks += other.checks
+        self.max_depth = max(self.max_depth, other.max_depth)
+        self.prunings.update(other.prunings)
+        self.wipeouts.update(other.wipeouts)
+        self.select_seconds += other.select_seconds
+        self.order_seconds += other.order_seconds
+        self.inference_seconds += other.inference_seconds
+
+    def as_dict(self):
+        """Return the stats as a dict of plain values, the variables of prunings and
+        wipeouts as strings, most pruned (or wiped out) first."""
+        return dict(assignments=self.assignments, backtracks=self.backtracks, checks=self.checks,
+                    max_depth=self.max_depth,
+                    prunings={str(var): n for var, n in self.prunings.most_common()},
+                    wipeouts={str(var): n for var, n in self.wipeouts.most_common()},
+                    select_seconds=self.select_seconds, order_seconds=self.order_seconds,
+                    inference_seconds=self.inference_seconds)
+
+    def to_json(self, **kwargs):
+        """Return as_dict as JSON; kwargs go to json.dumps."""
+        return json.dumps(self.as_dict(), **kwargs)
+
+
+def instrumented(csp, select_unassigned_variable, order_domain_values, inference):
+    """Return the heuristics of a search of csp wrapped to record it in csp.stats, or as
+    they are if csp.stats is None. Each inference follows the assignment it checks, so it
+    counts the assignments and the depth, and the search trail tells what it pruned."""
+    stats = csp.stats
+    if stats is None:
+        return select_unassigned_variable, order_domain_values, inference
+
+    def select(assignment, csp):
+        start = perf_counter()
+        var = select_unassigned_variable(assignment, csp)
+        stats.select_seconds += perf_counter() - start
+        return var
+
+    def order(var, assignment, csp):
+        start = perf_counter()
+        values = order_domain_values(var, assignment, csp)
+        stats.order_seconds += perf_counter() - start
+        yield from values
+        stats.backtracks += 1
+
+    def infer(csp, var, value, assignment, removals):
+        stats.assignments += 1
+        stats.max_depth = max(stats.max_depth, len(assignment))
+        mark = csp.marks[-1]
+        csp.last_wipeout = None
+        start = perf_counter()
+        consistent = inference(csp, var, value, assignment, removals)
+        stats.inference_seconds += perf_counter() - start
+        for B, removed in removals[mark:]:
+            if B != var:
+                stats.prunings[B] += removed.bit_count()
+        if not consistent and csp.last_wipeout is not None:
+            stats.wipeouts[csp.last_wipeout] += 1
+        return consistent
+
+    return select, order, infer
 
 
 # The search, proper
@@ -321,6 +897,9 @@ def mac(csp, var, value, assignment, removals, constraint_propagation=AC3b):
 def backtracking_search(csp, select_unassigned_variable=first_unassigned_variable,
                         order_domain_values=unordered_domain_values, inference=no_inference):
     """[Figure 6.5]"""
+    csp.buckets = None  # Buckets left by an earlier search miss the variables it assigned
+    select_unassigned_variable, order_domain_values, inference = instrumented(
+        csp, select_unassigned_variable, order_domain_values, inference)
 
     def backtrack(assignment):
         if len(assignment) == len(csp.variables):
@@ -343,6 +922,455 @@ def backtracking_search(csp, select_unassigned_variable=first_unassigned_variabl
     return result
 
 
+# The search, with an explicit stack
+
+
+class BacktrackingSearch:
+    """The search of backtracking_search, with an explicit stack of frames instead of
+    recursion, so that the depth of the search is not bounded by the recursion limit, and
+    so that it can be paused and resumed.
+
+    Each frame of stack is [var, values, removals]: the variable assigned at that depth, the
+    iterator of its values still to try, and the removals of the value it holds while the
+    search is below it (None otherwise). The variables, values, checks and inferences are
+    those of the recursive search, in the same order, with the same heuristics.
+
+    >>> search = BacktrackingSearch(csp, mrv, inference=forward_checking)   # doctest: +SKIP
+    >>> while (solution := search.resume(max_nodes=1000)) is None and not search.finished:
+    ...     pass   # e.g. check a deadline, or report progress
+    """
+
+    def __init__(self, csp, select_unassigned_variable=first_unassigned_variable,
+                 order_domain_values=unordered_domain_values, inference=no_inference):
+        self.csp = csp
+        csp.buckets = None
+        self.select_unassigned_variable, self.order_domain_values, self.inference = instrumented(
+            csp, select_unassigned_variable, order_domain_values, inference)
+        self.assignment = {}
+        self.stack = None  # Set up by the first resume
+        self.finished = False  # True once every assignment has been tried
+
+    def push(self):
+        """Select the next variable and push its frame."""
+        var = self.select_unassigned_variable(self.assignment, self.csp)
+        self.stack.append([var, iter(self.order_domain_values(var, self.assignment, self.csp)), None])
+
+    def resume(self, max_nodes=None):
+        """Run the search until it finds a solution, and return it as a new dict; or until it
+        has tried every assignment, and return None with finished set; or until it makes
+        max_nodes assignments (None for no limit), and return None: the next call goes on
+        from there. After a solution, the next call goes on to the next solution."""
+        csp, assignment, inference = self.csp, self.assignment, self.inference
+        if self.finished:
+            return None
+        if self.stack is None:
+            self.stack = []
+            if len(assignment) == len(csp.variables):
+                self.finished = True
+                return dict(assignment)
+            self.push()
+        stack = self.stack
+        nassigns = csp.nassigns
+        while stack:
+            frame = stack[-1]
+            var, values, removals = frame
+            if removals is not None:
+                # Back from below var: undo its value before trying the next one
+                frame[2] = None
+                csp.restore(removals)
+            for value in values:
+                if 0 != csp.nconflicts(var, value, assignment):
+                    continue
+                if max_nodes is not None and csp.nassigns - nassigns >= max_nodes:
+                    frame[1] = chain((value,), values)  # Try value first when resumed
+                    return None
+                csp.assign(var, value, assignment)
+                removals = csp.suppose(var, value)
+                if inference(csp, var, value, assignment, removals):
+                    frame[2] = removals
+                    if len(assignment) == len(csp.variables):
+                        return dict(assignment)
+                    self.push()
+                    break
+                csp.restore(removals)
+            else:
+                csp.unassign(var, assignment)
+                stack.pop()
+        self.finished = True
+        return None
+
+
+def iterative_backtracking_search(csp, select_unassigned_variable=first_unassigned_variable,
+                                  order_domain_values=unordered_domain_values, inference=no_inference):
+    """backtracking_search with an explicit stack (BacktrackingSearch): the same search and
+    result, without the recursion limit on the number of variables."""
+    result = BacktrackingSearch(csp, select_unassigned_variable, order_domain_values, inference).resume()
+    assert result is None or csp.goal_test(result)
+    return result
+
+
+# Conflict-directed backjumping
+
+
+class Nogoods:
+    """A bounded store of nogoods: partial assignments, each a tuple of (var, value), that no
+    solution extends. It keeps the last capacity nogoods of at most max_size variables,
+    indexed by each of their (var, value) pairs, so that checking a value only looks at the
+    nogoods that hold it. Nogoods stay valid for the csp they were learned on, so a store can
+    be shared by several searches of it."""
+
+    def __init__(self, capacity, max_size=8):
+        self.capacity = capacity
+        self.max_size = max_size
+        self.index = defaultdict(list)  # {(var, value): [nogoods holding var=value]}
+        self.learned = deque()  # The nogoods, oldest first
+
+    def __len__(self):
+        return len(self.learned)
+
+    def learn(self, variables, assignment):
+        """Add the values of variables in assignment as a nogood, if it is small enough,
+        and forget the oldest nogood past capacity."""
+        if not self.capacity or not variables or len(variables) > self.max_size:
+            return
+        nogood = tuple((X, assignment[X]) for X in variables)
+        for pair in nogood:
+            self.index[pair].append(nogood)
+        self.learned.append(nogood)
+        if len(self.learned) > self.capacity:
+            oldest = self.learned.popleft()
+            for pair in oldest:
+                self.index[pair].remove(oldest)
+                if not self.index[pair]:
+                    del self.index[pair]
+
+    def conflict(self, var, value, assignment):
+        """Return the other variables of a nogood that var=value would complete, or None."""
+        for nogood in self.index.get((var, value), ()):
+            if all(X == var or X in assignment and assignment[X] == x for X, x in nogood):
+                return {X for X, _ in nogood if X != var}
+        return None
+
+
+def cbj_search(csp, select_unassigned_variable=first_unassigned_variable,
+               order_domain_values=unordered_domain_values, inference=forward_checking,
+               max_nogoods=0, max_nogood_size=8, nogoods=None):
+    """Backtracking search with conflict-directed backjumping (FC-CBJ, Prosser 1993).
+    Each dead end returns its conflict set, the assigned variables that explain it: those
+    that conflict with one of its values, or whose forward checking pruned its domain (or,
+    for a value that emptied the domain of B, that of B). The search jumps straight back to
+    the last assigned variable of that set, skipping the ones in between (csp.nbackjumps
+    counts them), and that variable adds the rest of the set to its own.
+    inference must be forward_checking or no_inference, whose prunings are each explained by
+    the one assignment that made them; mac and sum_propagation prune through chains of
+    domains that such conflict sets do not follow.
+    The conflict set of each dead end is learned as a nogood in nogoods, a Nogoods store
+    (by default a new one of max_nogoods nogoods of at most max_nogood_size variables;
+    max_nogoods=0 learns none), and values that would complete one are skipped."""
+    if inference not in (forward_checking, no_inference):
+        raise ValueError('cbj_search needs forward_checking or no_inference, not {}'.format(inference.__name__))
+    csp.buckets = None
+    select_unassigned_variable, order_domain_values, inference = instrumented(
+        csp, select_unassigned_variable, order_domain_values, inference)
+    if nogoods is None:
+        nogoods = Nogoods(max_nogoods, max_nogood_size)
+    pruned_by = defaultdict(list)  # {B: [assigned variables whose inference pruned B, in assignment order]}
+
+    def culprits(var, value, assignment):
+        """The assigned variables that var=value conflicts with."""
+        blamed = nogoods.conflict(var, value, assignment)
+        if blamed is not None:
+            return blamed
+        if 0 == csp.nconflicts(var, value, assignment):
+            return None
+        assigned = [B for B in csp.neighbors[var] if B in assignment]
+        # nconflicts may count constraints over more than two variables, such as the sums of
+        # Kakuro; the assigned neighbors then stand in for the culprits
+        return ({B for B in assigned if not csp.constraints(var, value, B, assignment[B])}
+                or set(assigned))
+
+    def backtrack(assignment):
+        if len(assignment) == len(csp.variables):
+            return assignment, None
+        var = select_unassigned_variable(assignment, csp)
+        conflict = set()
+        for value in order_domain_values(var, assignment, csp):
+            blamed = culprits(var, value, assignment)
+            if blamed is not None:
+                conflict |= blamed
+                continue
+            csp.assign(var, value, assignment)
+            removals = csp.suppose(var, value)
+            mark = csp.marks[-1]
+            consistent = inference(csp, var, value, assignment, removals)
+            pruned = list(dict.fromkeys(B for B, _ in removals[mark:] if B != var))
+            for B in pruned:
+                pruned_by[B].append(var)
+            if consistent:
+                result, jump = backtrack(assignment)
+                if result is not None:
+                    return result, None
+            else:
+                jump = set(pruned_by[csp.last_wipeout])
+            for B in pruned:
+                pruned_by[B].pop()
+            csp.restore(removals)
+            if var not in jump:
+                # Nothing var could take would fix the dead end: jump over it
+                csp.unassign(var, assignment)
+                csp.nbackjumps += 1
+                return None, jump
+            conflict |= jump
+            conflict.discard(var)
+        csp.unassign(var, assignment)
+        conflict.update(pruned_by[var])
+        nogoods.learn(conflict, assignment)
+        return None, conflict
+
+    result, _ = backtrack({})
+    assert result is None or csp.goal_test(result)
+    return result
+
+
+# Randomized restarts
+
+
+def luby(i):
+    """The i-th term, from i=1, of the Luby sequence 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ..."""
+    while True:
+        k = i.bit_length()
+        if i == (1 << k) - 1:
+            return 1 << (k - 1)
+        i -= (1 << (k - 1)) - 1
+
+
+RESTART_SCHEDULES = {
+    'luby': lambda run, scale, factor: scale * luby(run + 1),
+    'geometric': lambda run, scale, factor: int(scale * factor ** run),
+}
+
+
+class SearchCutoff(Exception):
+    """Raised in a search when a restart run uses up its failures."""
+
+
+def fail_limited(order_domain_values, max_fails):
+    """Wrap a value ordering to raise SearchCutoff once max_fails variables have run out of
+    values: a search only goes through all the values of a variable at a dead end."""
+    fails = 0
+
+    def order(var, assignment, csp):
+        nonlocal fails
+        yield from order_domain_values(var, assignment, csp)
+        fails += 1
+        if fails >= max_fails:
+            raise SearchCutoff()
+
+    return order
+
+
+def restart_search(csp, select_unassigned_variable=bucket_mrv, order_domain_values=unordered_domain_values,
+                   inference=forward_checking, schedule='luby', scale=32, factor=1.5, seed=None,
+                   max_restarts=None, backjump=False, max_nogoods=0, max_nogood_size=8):
+    """Randomized backtracking_search (or cbj_search if backjump) that starts over whenever a
+    run hits its failure limit: the number of dead ends given by schedule, 'luby' (scale times
+    the Luby sequence) or 'geometric' (scale times factor ** run). Runs differ by the random
+    tie-breaking of the variable ordering (bucket_mrv, mrv or dom_wdeg), and of the values
+    with order_domain_values=shuffled_domain_values, so a run that went down a bad early
+    choice is soon dropped for another, which caps heavy-tailed search times; the growing
+    limits keep the search complete. Each run seeds the random module from seed, so a seed
+    reproduces the whole search; the caller's state of the random module is restored on
+    return. What the runs learn carries over: the constraint weights of dom_wdeg and, with
+    backjump and max_nogoods, the nogoods (see cbj_search). Without nogoods, each run has to
+    find again the dead ends the earlier ones ruled out.
+    Return a solution, or None if csp has none or the run after max_restarts restarts was
+    cut off too (csp.nrestarts counts the restarts)."""
+    rng = random.Random(seed)
+    limit = RESTART_SCHEDULES[schedule]
+    nogoods = Nogoods(max_nogoods, max_nogood_size)
+    run = 0
+    state = random.getstate()  # Restored after, so that the caller's random sequence carries on
+    try:
+        while max_restarts is None or run <= max_restarts:
+            random.seed(rng.random())
+            order = fail_limited(order_domain_values, max(1, limit(run, scale, factor)))
+            try:
+                if backjump:
+                    return cbj_search(csp, select_unassigned_variable, order, inference, nogoods=nogoods)
+                return backtracking_search(csp, select_unassigned_variable, order, inference)
+            except SearchCutoff:
+                # Undo the inferences of the run; the next run rebuilds the buckets of bucket_mrv
+                while csp.curr_domains and csp.marks:
+                    csp.restore(csp.trail)
+                csp.nrestarts += 1
+                run += 1
+    finally:
+        random.setstate(state)
+    return None
+
+
+# Enumerating and counting solutions
+
+
+def iter_solutions(csp, limit=None, select_unassigned_variable=first_unassigned_variable,
+                   order_domain_values=unordered_domain_values, inference=no_inference, max_nodes=None):
+    """Yield each solution of csp as it is found, with the search of backtracking_search, up to
+    limit of them (None for all) and until max_nodes assignments are made (None for no limit).
+    Each solution is a new dict and none is kept, so memory does not grow with their number.
+    After each solution the search backtracks from it, undoing its inferences, instead of
+    starting over. Closing the generator early restores the domains of csp."""
+    csp.buckets = None
+    select_unassigned_variable, order_domain_values, inference = instrumented(
+        csp, select_unassigned_variable, order_domain_values, inference)
+    nassigns = csp.nassigns
+
+    def backtrack(assignment):
+        if len(assignment) == len(csp.variables):
+            yield dict(assignment)
+            return
+        var = select_unassigned_variable(assignment, csp)
+        try:
+            for value in order_domain_values(var, assignment, csp):
+                if max_nodes is not None and csp.nassigns - nassigns >= max_nodes:
+                    return
+                if 0 == csp.nconflicts(var, value, assignment):
+                    csp.assign(var, value, assignment)
+                    removals = csp.suppose(var, value)
+                    try:
+                        if inference(csp, var, value, assignment, removals):
+                            yield from backtrack(assignment)
+                    finally:
+                        csp.restore(removals)
+        finally:
+            csp.unassign(var, assignment)
+
+    solutions = backtrack({})
+    try:
+        for found, solution in enumerate(solutions, 1):
+            yield solution
+            if found == limit:
+                return
+    finally:
+        solutions.close()
+
+
+# complete is False if the search stopped at limit or max_nodes before exploring every
+# assignment (or used up max_nodes exactly on its last one)
+SolutionCount = namedtuple('SolutionCount', 'count nodes seconds complete')
+
+
+def count_solutions(csp, limit=2, select_unassigned_variable=first_unassigned_variable,
+                    order_domain_values=unordered_domain_values, inference=no_inference,
+                    on_solution=None, max_nodes=None):
+    """Count the solutions of csp yielded by iter_solutions, stopping as soon as limit of them
+    are found (limit=None counts them all) or max_nodes assignments are made; on_solution,
+    if given, is called with each solution.
+    Return SolutionCount(count, nodes, seconds, complete), nodes being the assignments made."""
+    count = 0
+    nassigns, start = csp.nassigns, perf_counter()
+    for solution in iter_solutions(csp, limit, select_unassigned_variable, order_domain_values, inference,
+                                   max_nodes):
+        count += 1
+        if on_solution is not None:
+            on_solution(solution)
+    nodes = csp.nassigns - nassigns
+    complete = (limit is None or count < limit) and (max_nodes is None or nodes < max_nodes)
+    return SolutionCount(count, nodes, perf_counter() - start, complete)
+
+
+def has_unique_solution(csp, **kwargs):
+    """Does csp have exactly one solution? Stops searching at the second one; kwargs are
+    the heuristics of count_solutions. None if max_nodes cut the search short."""
+    counted = count_solutions(csp, limit=2, **kwargs)
+    if counted.count < 2 and not counted.complete:
+        return None
+    return counted.count == 1
+
+
+# ______________________________________________________________________________
+# Independent components
+
+
+def connected_components(csp):
+    """Return the connected components of the constraint graph of csp (variables linked by
+    neighbors), each as a list of variables in csp.variables order."""
+    component_of = {}
+    components = []
+    for var in csp.variables:
+        if var in component_of:
+            continue
+        component_of[var] = len(components)
+        stack = [var]
+        while stack:
+            for B in csp.neighbors.get(stack.pop(), ()):
+                if B not in component_of:
+                    component_of[B] = len(components)
+                    stack.append(B)
+        components.append([])
+    for var in csp.variables:
+        components[component_of[var]].append(var)
+    return components
+
+
+def component_csp(csp, variables):
+    """Return a copy of csp restricted to variables, which must be closed under neighbors.
+    The copy shares domains, neighbors and constraints with csp but has its own search state."""
+    sub = copy.copy(csp)
+    sub.variables = variables
+    sub.curr_domains = None
+    sub.nassigns = 0
+    sub.nbackjumps = 0
+    sub.nrestarts = 0
+    sub.buckets = None
+    sub.weights = Counter()
+    sub.residues = {}
+    sub.stats = SearchStats() if csp.stats is not None else None
+    return sub
+
+
+ComponentStats = namedtuple('ComponentStats', 'variables solved nassigns seconds')
+
+
+def solve_component(csp, solver, kwargs):
+    """Return (solver(csp, **kwargs), ComponentStats of the solve, csp.stats)."""
+    start = perf_counter()
+    result = solver(csp, **kwargs)
+    return (result, ComponentStats(len(csp.variables), result is not None, csp.nassigns, perf_counter() - start),
+            csp.stats)
+
+
+def solve_components(csp, solver=None, workers=0, **kwargs):
+    """Solve each connected component of csp on its own with solver(component, **kwargs)
+    (backtracking_search by default) and merge the results.
+    Return (assignment, stats): assignment is None if some component has no solution;
+    stats holds a ComponentStats per component, in connected_components order. If csp
+    records a SearchStats, each component records its own and they are added to it.
+    With workers > 0 the components are solved in that many processes, so csp, solver
+    and kwargs must pickle; otherwise they are solved in turn, stopping at the first failure."""
+    solver = solver or backtracking_search
+    subs = [component_csp(csp, variables) for variables in connected_components(csp)]
+    if workers and len(subs) > 1:
+        with ProcessPoolExecutor(min(workers, len(subs))) as executor:
+            solved = list(executor.map(solve_component, subs, repeat(solver), repeat(kwargs)))
+    else:
+        solved = []
+        for sub in subs:
+            solved.append(solve_component(sub, solver, kwargs))
+            if solved[-1][0] is None:
+                break
+    csp.nassigns += sum(stats.nassigns for _, stats, _ in solved)
+    if csp.stats is not None:
+        for _, _, search_stats in solved:
+            csp.stats.update(search_stats)
+    stats = [stats for _, stats, _ in solved]
+    if len(solved) < len(subs) or any(result is None for result, _, _ in solved):
+        return None, stats
+    assignment = {}
+    for result, _, _ in solved:
+        assignment.update(result)
+    return assignment, stats
+
+
 # ______________________________________________________________________________
 # Min-conflicts Hill Climbing search for CSPs
 
@@ -368,4 +1396,67 @@ def min_conflicts(csp, max_steps=100000):
 def min_conflicts_value(csp, var, current):
     """Return the value that will give var the least number of conflicts.
     If there is a tie, choose at random."""
-    return argmin_random_tie(csp.domains[var], key=lambda val: csp.nconflicts(var, val, current))
\ No newline at end of file
+    return argmin_random_tie(csp.domains[var], key=lambda val: csp.nconflicts(var, val, current))
+
+
+# Min-conflicts with incremental conflict counts
+# nconflicts(var) only depends on the values of var and of its neighbors, so when one variable
+# changes, only its own count and those of its neighbors need to be computed again, instead of
+# those of every variable as conflicted_vars does at each step.
+
+class ConflictCounts:
+    """The conflicts of every variable of a complete assignment of csp, current, kept up to
+    date through assign, with the set of the variables in conflict as a list, so that one can
+    be picked at random in constant time."""
+
+    def __init__(self, csp, current):
+        self.csp = csp
+        self.current = current
+        self.conflicts = {}  # {var: nconflicts of var in current}
+        self.total = 0  # The sum of conflicts
+        self.conflicted = []  # The variables with conflicts, in no particular order
+        self.positions = {}  # {var: index of var in conflicted}
+        for var in csp.variables:
+            self.update(var)
+
+    def __len__(self):
+        return len(self.conflicted)
+
+    def update(self, var):
+        """Count the conflicts of var again."""
+        n = self.csp.nconflicts(var, self.current[var], self.current)
+        self.total += n - self.conflicts.get(var, 0)
+        self.conflicts[var] = n
+        if n and var not in self.positions:
+            self.positions[var] = len(self.conflicted)
+            self.conflicted.append(var)
+        elif not n and var in self.positions:
+            # Move the last variable into the place of var
+            i = self.positions.pop(var)
+            last = self.conflicted.pop()
+            if last != var:
+                self.conflicted[i] = last
+                self.positions[last] = i
+
+    def assign(self, var, val):
+        """Set var to val in current, and count the conflicts of var and of its neighbors again."""
+        self.csp.assign(var, val, self.current)
+        self.update(var)
+        for B in self.csp.neighbors[var]:
+            self.update(B)
+
+
+def incremental_min_conflicts(csp, max_steps=100000):
+    """min_conflicts keeping the conflicts of the variables in a ConflictCounts, so that each
+    step costs in the degree of the changed variable rather than in the size of csp, and
+    choosing values with csp.min_conflict_values, which subclasses can do in one pass."""
+    csp.current = current = {}
+    for var in csp.variables:
+        csp.assign(var, random.choice(csp.min_conflict_values(var, current)), current)
+    counts = ConflictCounts(csp, current)
+    for i in range(max_steps):
+        if not counts.conflicted:
+            return current
+        var = random.choice(counts.conflicted)
+        counts.assign(var, random.choice(csp.min_conflict_values(var, current)))
+    return None
@@ -0,0 +1,301 @@
+"""Kakuro puzzle generator.
+
+    >>> puzzle = generate(8, 8, density=0.6, seed=1)   # doctest: +SKIP
+    >>> Kakuro(puzzle.grid).display()                    # doctest: +SKIP
+
+A puzzle is made in four steps: a layout of black and white cells where every run has
+2 to max_run cells; a fill of the white cells with digits, different along each run; the
+clues, summing the fill along each run; and a uniqueness check. The check counts the
+solutions of the nary Kakuro model with sum_propagation, stopping at the second one, and
+tries the digits of the fill first, so that a second solution, if found, is one that differs
+from the fill in few cells. While one exists, a cell where it differs gets another digit,
+and the clues of its two runs are changed in place on the same model (Kakuro.set_sum)
+before counting again, so the model is never rebuilt for a clue adjustment.
+
+The search itself does start over from the root after each adjustment, by design: a second
+solution of the new clues may differ from the fill anywhere, not only in the changed runs,
+so a check resumed from an assignment kept from the previous count could miss it. What
+keeps each count short is the propagation, not reuse: sum_propagation prunes the runs of
+every assigned cell, and trying the fill first walks straight down to it.
+
+Run as `python -m generator ROWS COLS [--count N] [--workers N]` to write puzzles in the
+format of corpus.py.
+"""
+
+import argparse
+import os
+import random
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from corpus import format_puzzle
+from csp import CSP, bucket_mrv, count_solutions, forward_checking, iterative_backtracking_search
+from kakuro import Kakuro, sum_combinations, sum_propagation
+
+MIN_RUN, MAX_RUN = 2, 9
+
+# A generated puzzle: its grid (in Kakuro's list form), the fill it was made from,
+# and how many clue adjustments and uniqueness checks it took
+Generated = namedtuple('Generated', 'grid solution adjustments checks')
+
+
+# ______________________________________________________________________________
+# Layout
+
+
+def runs_of(white, i, j, di, dj):
+    """Return the cells of the run of white cells through (i, j) in direction (di, dj)."""
+    while white[i - di][j - dj]:
+        i, j = i - di, j - dj
+    cells = []
+    while i < len(white) and j < len(white[i]) and white[i][j]:
+        cells.append((i, j))
+        i, j = i + di, j + dj
+    return cells
+
+
+def fix_layout(white, rng, walls, max_run=MAX_RUN):
+    """Change cells of white, in place, until every run has MIN_RUN to max_run cells and the
+    white cells are connected. A lone white cell is extended by whitening a black neighbor
+    along its run, or blackened if it has none that can be; a long run is split by a black
+    cell. Cells blackened here are added to walls and never whitened again, so the fixing
+    terminates. Return whether anything changed."""
+    changed = False
+    for i in range(1, len(white)):
+        for j in range(1, len(white[i])):
+            if not white[i][j]:
+                continue
+            for di, dj in ((0, 1), (1, 0)):
+                run = runs_of(white, i, j, di, dj)
+                if len(run) < MIN_RUN:
+                    extensions = [(ni, nj) for ni, nj in ((i + di, j + dj), (i - di, j - dj))
+                                  if 1 <= ni < len(white) and 1 <= nj < len(white[ni]) and (ni, nj) not in walls]
+                    if extensions:
+                        ni, nj = rng.choice(extensions)
+                        white[ni][nj] = True
+                    else:
+                        white[i][j] = False
+                        walls.add((i, j))
+                    changed = True
+                    break
+                if len(run) > max_run:
+                    # Split the run, leaving at least MIN_RUN cells on each side
+                    bi, bj = run[rng.randrange(MIN_RUN, len(run) - MIN_RUN)]
+                    white[bi][bj] = False
+                    walls.add((bi, bj))
+                    changed = True
+                    break
+
+    # Keep the largest connected region of white cells
+    regions = []
+    seen = set()
+    for i in range(1, len(white)):
+        for j in range(1, len(white[i])):
+            if white[i][j] and (i, j) not in seen:
+                region, stack = [], [(i, j)]
+                seen.add((i, j))
+                while stack:
+                    ci, cj = stack.pop()
+                    region.append((ci, cj))
+                    for ni, nj in ((ci + 1, cj), (ci - 1, cj), (ci, cj + 1), (ci, cj - 1)):
+                        if (ni < len(white) and nj < len(white[ni]) and white[ni][nj]
+                                and (ni, nj) not in seen):
+                            seen.add((ni, nj))
+                            stack.append((ni, nj))
+                regions.append(region)
+    regions.sort(key=len, reverse=True)
+    for region in regions[1:]:
+        for i, j in region:
+            white[i][j] = False
+        walls.update(region)
+        changed = True
+    return changed
+
+
+def make_layout(rows, cols, density, rng, max_run=MAX_RUN):
+    """Return white[i][j] for a (rows + 1) x (cols + 1) grid whose first row and column are
+    black (clue) cells, with about density of the other cells white before fixing runs."""
+    white = [[False] * (cols + 1)] + [[False] + [rng.random() < density for _ in range(cols)]
+                                      for _ in range(rows)]
+    walls = set()
+    while fix_layout(white, rng, walls, max_run):
+        pass
+    return white
+
+
+# ______________________________________________________________________________
+# Fill and clues
+
+
+def different(A, a, B, b):
+    return a != b
+
+
+def fill_layout(white, rng):
+    """Return a dict of {(i, j): digit} filling the white cells with digits that are different
+    along every run, or None if the search finds none. The search has a level per white cell,
+    so it runs on an explicit stack rather than recursively."""
+    cells = [(i, j) for i in range(len(white)) for j in range(len(white[i])) if white[i][j]]
+    neighbors = {cell: [] for cell in cells}
+    for cell in cells:
+        for direction in ((0, 1), (1, 0)):
+            neighbors[cell] += [other for other in runs_of(white, *cell, *direction) if other != cell]
+    digits = list('123456789')
+    problem = CSP(cells, {cell: digits for cell in cells}, neighbors, different)
+    return iterative_backtracking_search(problem, select_unassigned_variable=bucket_mrv,
+                                         order_domain_values=lambda var, assignment, csp: rng.sample(
+                                             csp.choices(var), csp.domain_size(var)),
+                                         inference=forward_checking)
+
+
+def clue_grid(white, fill):
+    """Return the Kakuro grid of a layout and its fill: '_' for white cells, a [down, right]
+    clue for black cells that start a run and '*' for the others."""
+    grid = []
+    for i, row in enumerate(white):
+        grid.append([])
+        for j, is_white in enumerate(row):
+            if is_white:
+                grid[i].append('_')
+                continue
+            down = runs_of(white, i + 1, j, 1, 0) if i + 1 < len(white) and white[i + 1][j] else []
+            right = runs_of(white, i, j + 1, 0, 1) if j + 1 < len(row) and row[j + 1] else []
+            if down or right:
+                grid[i].append([sum(int(fill[cell]) for cell in down) if down else '',
+                                sum(int(fill[cell]) for cell in right) if right else ''])
+            else:
+                grid[i].append('*')
+    return grid
+
+
+# ______________________________________________________________________________
+# Generation
+
+
+def combinations_after(problem, fill, cell, digit):
+    """Return how many digit combinations the runs of cell would allow if it held digit."""
+    total = 0
+    for r, _ in problem.cell_runs[cell]:
+        cells = problem.run_cells[r]
+        run_sum = sum(int(digit if c == cell else fill[c]) for c in cells)
+        total += len(sum_combinations(len(cells), run_sum))
+    return total
+
+
+def make_unique(problem, fill, rng, max_adjustments, max_nodes):
+    """Adjust the clues of problem, a nary Kakuro built from fill (a dict of {cell: digit} by
+    variable name), until its only solution is fill. Return (adjustments, checks), or None if
+    it is still ambiguous after max_adjustments, or if a check needs more than max_nodes
+    assignments to settle. Each check is a complete count from the root (see the module
+    docstring)."""
+    def fill_first(var, assignment, csp):
+        return sorted(csp.choices(var), key=lambda digit: digit != fill[var])
+
+    for adjustment in range(max_adjustments + 1):
+        solutions = []
+        counted = count_solutions(problem, limit=2, select_unassigned_variable=bucket_mrv, order_domain_values=fill_first,
+                                  inference=sum_propagation, on_solution=solutions.append, max_nodes=max_nodes)
+        other = next((s for s in solutions if s != fill), None)
+        if other is None:
+            return (adjustment, adjustment + 1) if counted.complete else None
+        if adjustment == max_adjustments:
+            return None
+
+        # Give a random cell where the other solution differs another digit, keeping its runs
+        # all-different and preferring the digit whose clues allow the fewest combinations
+        # (always taking the best cell and digit tends to cycle between a few fills)
+        differing = [cell for cell in problem.variables if other[cell] != fill[cell]]
+        rng.shuffle(differing)
+        for cell in differing:
+            used = {fill[other_cell] for other_cell in problem.neighbors[cell]}
+            choices = [d for d in '123456789' if d not in used and d != fill[cell]]
+            if choices:
+                rng.shuffle(choices)
+                fill[cell] = min(choices, key=lambda d: combinations_after(problem, fill, cell, d))
+                break
+        else:
+            return None
+        for r, _ in problem.cell_runs[cell]:
+            problem.set_sum(problem.runs[r], sum(int(fill[c]) for c in problem.run_cells[r]))
+    return None
+
+
+def generate(rows, cols, density=0.6, seed=None, max_run=5, max_adjustments=200, max_nodes=5000,
+             max_attempts=100):
+    """Return a Generated puzzle with rows x cols playable cells (plus the clue row and column)
+    and a unique solution. density is the share of cells left white before runs are fixed,
+    and runs have at most max_run cells: long runs have many digit combinations and make
+    uniqueness much harder to reach. seed makes the result reproducible; for the time of the
+    call it also seeds the random module, which the search heuristics use for ties. A layout
+    is dropped if its clues are still ambiguous after max_adjustments, or if a uniqueness
+    check takes more than max_nodes assignments. Raise RuntimeError after max_attempts
+    dropped layouts."""
+    rng = random.Random(seed)
+    state = random.getstate()  # Restored after, so that the caller's random sequence carries on
+    random.seed(rng.random())
+    try:
+        for _ in range(max_attempts):
+            white = make_layout(rows, cols, density, rng, max_run)
+            if not any(any(row) for row in white):
+                continue
+            cells = fill_layout(white, rng)
+            if cells is None:
+                continue
+            problem = Kakuro(clue_grid(white, cells), encoding="nary")
+            fill = {'X{},{}'.format(i, j): digit for (i, j), digit in cells.items()}
+            result = make_unique(problem, fill, rng, max_adjustments, max_nodes)
+            if result is not None:
+                return Generated(problem.puzzle, fill, *result)
+    finally:
+        random.setstate(state)
+    raise RuntimeError('no unique {}x{} puzzle in {} attempts'.format(rows, cols, max_attempts))
+
+
+def generate_task(args):
+    """generate(*args) in a worker process."""
+    return generate(*args)
+
+
+def generate_many(count, rows, cols, density=0.6, seed=None, max_run=5, workers=None, chunksize=4):
+    """Yield count Generated puzzles, in order, made by workers processes (0: in this process;
+    None: one per core). Puzzle n is generate(..., seed=seed + n), so a seed makes the batch
+    reproducible whatever the number of workers."""
+    base = random.randrange(2 ** 32) if seed is None else seed
+    tasks = ((rows, cols, density, base + n, max_run) for n in range(count))
+    if workers == 0:
+        yield from map(generate_task, tasks)
+        return
+    with ProcessPoolExecutor(workers or os.cpu_count() or 1) as executor:
+        yield from executor.map(generate_task, tasks, chunksize=chunksize)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m generator',
+                                     description='Generate Kakuro puzzles with a unique solution, '
+                                                 'one per line in the format of corpus.py.')
+    parser.add_argument('rows', type=int, help='playable rows')
+    parser.add_argument('cols', type=int, help='playable columns')
+    parser.add_argument('--count', type=int, default=1, help='puzzles to generate (default: 1)')
+    parser.add_argument('--density', type=float, default=0.6,
+                        help='share of white cells before runs are fixed (default: 0.6)')
+    parser.add_argument('--max-run', type=int, default=5, choices=range(MIN_RUN, MAX_RUN + 1), metavar='N',
+                        help='longest run of white cells, {} to {} (default: 5)'.format(MIN_RUN, MAX_RUN))
+    parser.add_argument('--seed', type=int, help='seed of the first puzzle; the next ones use seed + 1, ...')
+    parser.add_argument('--workers', type=int, help='worker processes; 0 generates in this process '
+                                                    '(default: one per core)')
+    parser.add_argument('--format', choices=('text', 'json'), default='text', help='puzzle line format')
+    args = parser.parse_args(argv)
+
+    start = perf_counter()
+    for n, puzzle in enumerate(generate_many(args.count, args.rows, args.cols, args.density,
+                                             args.seed, args.max_run, args.workers)):
+        print(format_puzzle(puzzle.grid, 'generated{}'.format(n), args.format))
+    seconds = perf_counter() - start
+    print('{} puzzles in {:.2f} s ({:.1f} per minute)'.format(args.count, seconds, 60 * args.count / seconds),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
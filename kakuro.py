@@ -1,6 +1,19 @@
+import argparse
+import json
+import random
 from csp import *
 from time import time
-from itertools import permutations
+from functools import lru_cache, partial
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from heapq import merge
+from itertools import combinations, permutations
+
+try:
+	import numpy as np
+except ImportError: # Only compatibility matrices need it
+	np = None
 
 
 ######### Kakuro puzzles
@@ -69,12 +82,165 @@ kakuro_hard8x8 = [
 	]
 
 
+# Bundled puzzles by name
+PUZZLES = {
+	'given4x3': kakuro_given4x3,
+	'given5x7': kakuro_given5x7,
+	'given14x14': kakuro_given14x14,
+	'intermediate6x6': kakuro_intermediate6x6,
+	'hard8x8': kakuro_hard8x8,
+	}
+
+
+######### Sum-combination table
+
+""" Map every (run length, target sum) to the sets of distinct digits, as sorted strings, that add up to it """
+def build_sum_combinations():
+	table = {}
+	for length in range(1, 10):
+		for combo in combinations('123456789', length):
+			table.setdefault((length, sum(int(x) for x in combo)), []).append("".join(combo))
+	return table
+
+# Built once at import and shared by every Kakuro instance
+SUM_COMBINATIONS = build_sum_combinations()
+
+""" Return the digit sets of length distinct digits that add up to total """
+def sum_combinations(length, total):
+	return SUM_COMBINATIONS.get((length, total), [])
+
+""" Lazily yield every ordering of the digit sets of sum_combinations(length, total),
+	in the same lexicographic order as filtering permutations('123456789', length) """
+def sum_permutations(length, total):
+	return merge(*(map("".join, permutations(combo)) for combo in sum_combinations(length, total)))
+
+""" Domain of the hidden variable of a run with length cells adding up to total.
+	Built once per process and shared by every Kakuro instance: domains are never modified """
+@lru_cache(maxsize=None)
+def run_domain(length, total):
+	return PackedPermutations(sum_permutations(length, total))
+
+
+""" Read-only sequence of permutations (strings of digits) packed 4 bits per digit into an array('Q').
+	A permutation packs to int(perm, 16), so sorted permutations of one length pack to sorted ints,
+	and index and in are binary searches. """
+class PackedPermutations(Sequence):
+
+	def __init__(self, perms):
+		self.packed = array('Q', (int(perm, 16) for perm in perms))
+
+	def __len__(self):
+		return len(self.packed)
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [format(x, "x") for x in self.packed[i]]
+		return format(self.packed[i], "x")
+
+	def __iter__(self):
+		return (format(x, "x") for x in self.packed)
+
+	""" Index of perm; the permutations must be sorted, as those of run_domain are """
+	def index(self, perm, start=0, stop=None):
+		x = int(perm, 16)
+		i = bisect_left(self.packed, x, start, len(self.packed) if stop is None else stop)
+		if i == len(self.packed) or self.packed[i] != x:
+			raise ValueError(repr(perm) + " is not in the permutations")
+		return i
+
+	def __contains__(self, perm):
+		try:
+			self.index(perm)
+		except (ValueError, TypeError):
+			return False
+		return True
+
+	def __repr__(self):
+		return "PackedPermutations(" + repr(list(self)) + ")"
+
+
+######### Digit bitmasks
+
+# Bit d - 1 of a cell mask stands for digit d
+DIGIT_BITS = {str(d): 1 << (d - 1) for d in range(1, 10)}
+
+# Digits of every 9-bit mask in increasing order; len() of an entry is the mask's popcount
+MASK_DIGITS = [tuple(str(d) for d in range(1, 10) if mask & (1 << (d - 1))) for mask in range(1 << 9)]
+
+# Indices of the set bits (digit - 1) of every 9-bit mask
+MASK_INDICES = [tuple(k for k in range(9) if mask & (1 << k)) for mask in range(1 << 9)]
+
+""" Return the mask of an iterable of digits """
+def digits_mask(digits):
+	mask = 0
+	for d in digits:
+		mask |= DIGIT_BITS[d]
+	return mask
+
+# Masks of the digit sets of SUM_COMBINATIONS, by (run length, target sum)
+COMBINATION_MASKS = {key: [digits_mask(combo) for combo in combos] for key, combos in SUM_COMBINATIONS.items()}
+
+""" Return the masks of the digit sets of length distinct digits that add up to total """
+def combination_masks(length, total):
+	return COMBINATION_MASKS.get((length, total), [])
+
+
+######### Table constraints
+
+""" Return supports[pos][d - 1]: the bitset of the indices of the permutations that have digit d at position pos """
+def permutation_supports(perms, length):
+	columns = [[bytearray(b"0" * len(perms)) for d in range(9)] for pos in range(length)]
+	for i, perm in enumerate(perms):
+		for pos in range(length):
+			columns[pos][int(perm[pos]) - 1][i] = ord("1")
+	# Bit i of a support is character i of its column
+	return [[int(column[::-1] or b"0", 2) for column in digits] for digits in columns]
+
+""" Table constraint of a run with length cells adding up to total: the supports of run_domain(length, total).
+	Built once per process and shared like run_domain """
+@lru_cache(maxsize=None)
+def run_table(length, total):
+	return permutation_supports(run_domain(length, total), length)
+
+""" Compatibility matrix of the arc from a cell at position pos of a run with length cells adding up to total
+	to its hidden variable: entry [d - 1, i] is whether permutation i of run_domain(length, total) has digit d
+	at pos. Built once per process and shared like run_domain; needs numpy """
+@lru_cache(maxsize=None)
+def run_matrix(length, total, pos):
+	perms = np.array(run_domain(length, total).packed, dtype=np.uint64)
+	digits = (perms >> np.uint64(4 * (length - 1 - pos))) & np.uint64(15)
+	return digits == np.arange(1, 10, dtype=np.uint64)[:, None]
+
+""" Build the domains, and the tables if tables is true, of every run of up to max_length cells ahead of time,
+	e.g. when a worker process starts; longer runs are built the first time a puzzle needs them """
+def warm_tables(max_length=6, tables=False):
+	for length, total in SUM_COMBINATIONS:
+		if length <= max_length:
+			run_domain(length, total)
+			if tables:
+				run_table(length, total)
+
+""" Drop the domains and tables built so far """
+def clear_tables():
+	run_domain.cache_clear()
+	run_table.cache_clear()
+	run_matrix.cache_clear()
+
 ######### Kakuro class implementation
 
 class Kakuro(CSP):
 
-	""" Constructor method given the kakuro puzzle to be solved as argument """
-	def __init__(self, kakuro_puzzle):
+	""" Constructor method given the kakuro puzzle to be solved as argument.
+		With bitmask=True runs are also compiled into table constraints, bitsets over the permutations
+		of each run with a given digit at a given position, which forward checking and compact_table use.
+		encoding selects how runs are modelled:
+			"hidden": each run is a hidden variable whose domain is every valid permutation (binary constraints)
+			"nary": each run is an all-different + sum constraint on its cells, enforced by nconflicts
+					and propagated by sum_propagation; implies bitmask=True """
+	def __init__(self, kakuro_puzzle, bitmask=False, encoding="hidden"):
+		if encoding not in ("hidden", "nary"):
+			raise ValueError("unknown encoding: " + repr(encoding))
+
 		variables = [] # A list of variables; each is atomic
 
 		domains = {} # A dict of {var:[possible_value, ...]} entries
@@ -83,6 +249,10 @@ class Kakuro(CSP):
         			   # the other variables that participate in constraints.
 
 		self.puzzle = kakuro_puzzle
+		self.encoding = encoding
+		self.bitmask = bitmask or encoding == "nary"
+		self.sums = {} # A dict of {run:sum} entries; each run is named after its hidden variable
+		self.clues = {} # A dict of {run:(i, j, k)} entries: its sum is kakuro_puzzle[i][j][k]
 
 		for i in range(len(kakuro_puzzle)): # Index for each line
 			for j in range(len(kakuro_puzzle[i])): # Index for each cell in each line
@@ -99,7 +269,10 @@ class Kakuro(CSP):
 					# Sum of cells down
 					if kakuro_puzzle[i][j][0] != "":
 						hidden_var = "C_d" + str(i) + "," + str(j)
-						variables.append(hidden_var) # Add hidden variable to convert n-ary sum constraint to binary
+						self.sums[hidden_var] = kakuro_puzzle[i][j][0]
+						self.clues[hidden_var] = (i, j, 0)
+						if encoding == "hidden":
+							variables.append(hidden_var) # Add hidden variable to convert n-ary sum constraint to binary
 
 						cell_counter = 0
 						for m in range(i + 1, len(kakuro_puzzle)):
@@ -118,13 +291,16 @@ class Kakuro(CSP):
 
 							cell_counter += 1
 
-						perms = list(map("".join, permutations('123456789', cell_counter)))
-						domains[hidden_var] = [perm for perm in perms if sum(int(x) for x in perm) == kakuro_puzzle[i][j][0]]
+						if encoding == "hidden":
+							domains[hidden_var] = run_domain(cell_counter, self.sums[hidden_var])
 
 					# Sum of cells right
 					if kakuro_puzzle[i][j][1] != "":
 						hidden_var = "C_r" + str(i) + "," + str(j)
-						variables.append(hidden_var) # Add hidden variable to convert n-ary constraint of sum to binary
+						self.sums[hidden_var] = kakuro_puzzle[i][j][1]
+						self.clues[hidden_var] = (i, j, 1)
+						if encoding == "hidden":
+							variables.append(hidden_var) # Add hidden variable to convert n-ary constraint of sum to binary
 
 						cell_counter = 0
 						for k in range(j + 1, len(kakuro_puzzle[i])):
@@ -143,57 +319,186 @@ class Kakuro(CSP):
 
 							cell_counter += 1
 
-						perms = list(map("".join, permutations('123456789', cell_counter)))
-						domains[hidden_var] = [perm for perm in perms if sum(int(x) for x in perm) == kakuro_puzzle[i][j][1]]
+						if encoding == "hidden":
+							domains[hidden_var] = run_domain(cell_counter, self.sums[hidden_var])
 						
-		CSP.__init__(self, variables, domains, neighbors, self.kakuro_constraint)
+		run_cells = {run: neighbors[run] for run in self.sums}
+
+		if encoding == "hidden":
+			CSP.__init__(self, variables, domains, neighbors, self.kakuro_constraint)
+		else:
+			for var in variables:
+				# Each cell neighbors the other cells of its runs
+				neighbors[var] = [cell for run in neighbors[var] for cell in run_cells[run] if cell != var]
+			for run in run_cells:
+				del neighbors[run]
+			CSP.__init__(self, variables, domains, neighbors, self.all_different_constraint)
+		self.compile(run_cells)
+		if encoding == "nary":
+			self.narrow_domains(self.variables)
+
+	""" In the nary encoding, narrow the domains of cells to the digits of some digit set of each of their runs """
+	def narrow_domains(self, cells):
+		for cell in cells:
+			mask = (1 << 9) - 1
+			for r, _ in self.cell_runs[cell]:
+				run_mask = 0
+				for combo in combination_masks(len(self.run_cells[r]), self.sums[self.runs[r]]):
+					run_mask |= combo
+				mask &= run_mask
+			self.domains[cell] = list(MASK_DIGITS[mask])
+
+	""" Change the sum of run to total in place, rebuilding only what depends on it: the domain (and table)
+		of its hidden variable, or the domains of its cells in the nary encoding. Current domains, compatibility
+		matrices and the residues of the run's arcs are dropped, and the puzzle is copied before its clue is changed. """
+	def set_sum(self, run, total):
+		r = self.run_ids[run]
+		self.sums[run] = total
+		i, j, k = self.clues[run]
+		self.puzzle = [list(row) for row in self.puzzle]
+		self.puzzle[i][j] = list(self.puzzle[i][j])
+		self.puzzle[i][j][k] = total
+
+		length = len(self.run_cells[r])
+		if self.encoding == "hidden":
+			self.domains[run] = run_domain(length, total)
+			if self.bitmask:
+				self.tables[r] = run_table(length, total)
+		else:
+			self.narrow_domains(self.run_cells[r])
+		self.curr_domains = None
+		if self.matrices is not None:
+			self.matrices.clear()
+		# Residual supports of AC3rm on the arcs of the run may be values of the old domain
+		self.residues = {key: y for key, y in self.residues.items() if run not in (key[0], key[2])}
+
+	""" Compile the constraint model given the cells of each run: dense integer ids for the runs,
+		and a (run id, position) entry for every cell-run arc, in both directions """
+	def compile(self, run_cells):
+		self.runs = list(run_cells) # Name of each run id
+		self.run_ids = {run: r for r, run in enumerate(self.runs)}
+		self.run_cells = [tuple(run_cells[run]) for run in self.runs] # Cells of each run id, in order
+		self.cell_runs = {} # A dict of {cell:[(run id, position), ...]} entries
+		self.arcs = {} # A dict of {(A, B):(run id, position of the cell in the run)} entries
+
+		for r, run in enumerate(self.runs):
+			for pos, cell in enumerate(self.run_cells[r]):
+				self.cell_runs.setdefault(cell, []).append((r, pos))
+				self.arcs[cell, run] = self.arcs[run, cell] = (r, pos)
+
+		# Table constraints of the runs for bitmask domains of hidden variables
+		if self.bitmask and self.encoding == "hidden":
+			self.tables = [run_table(len(self.run_cells[r]), self.sums[run]) for r, run in enumerate(self.runs)]
 
 	""" A function that returns true if neighbors A, B satisfy 
 		kakuro's constraints when they have values A = a, B = b """
 	def kakuro_constraint(self, A, a, B, b):
-		if A[0] == "X" and B[0] == "C":
-			X_i = int(A[1 : A.index(",")])
-			X_j = int(A[A.index(",") + 1 :])
-
-			C_i = int(B[3 : B.index(",")])
-			C_j = int(B[B.index(",") + 1 :])
-
-			if B[2] == "d":
-				ind = X_i - C_i - 1 # Index of character to be checked
-				hidden_var = "C_d" + str(C_i) + "," + str(C_j)
-
-				if b[ind] == a: #and sum(int(x) for x in b) == self.sums[hidden_var]:
-					return True
-
-			else: # B[2] == "r":
-				ind = X_j - C_j - 1 # Index of character to be checked
-				hidden_var = "C_r" + str(C_i) + "," + str(C_j)
-
-				if b[ind] == a: #and sum(int(x) for x in b) == self.sums[hidden_var]:
-					return True
-
-		elif A[0] == "C" and B[0] == "X":
-			C_i = int(A[3 : A.index(",")])
-			C_j = int(A[A.index(",") + 1 :])
-
-			X_i = int(B[1 : B.index(",")])
-			X_j = int(B[B.index(",") + 1 :])
-
-			if A[2] == "d":
-				ind = X_i - C_i - 1 # Index of character to be checked
-				hidden_var = "C_d" + str(C_i) + "," + str(C_j)
-
-				if a[ind] == b:# and sum(int(x) for x in a) == self.sums[hidden_var]:
-					return True
-
-			else: # A[2] == "r":
-				ind = X_j - C_j - 1 # Index of character to be checked
-				hidden_var = "C_r" + str(C_i) + "," + str(C_j)
-
-				if a[ind] == b:# and sum(int(x) for x in a) == self.sums[hidden_var]:
-					return True
-
-		return False
+		pos = self.arcs[A, B][1]
+		if A[0] == "X":
+			return b[pos] == a
+		return a[pos] == b
+
+	""" Constraint between two cells of a run in the nary encoding """
+	def all_different_constraint(self, A, a, B, b):
+		return a != b
+
+	""" In the nary encoding, also count the runs of var whose sum var=val makes unreachable
+		given the assigned cells; the binary constraints only cover all-different """
+	def nconflicts(self, var, val, assignment):
+		conflicts = CSP.nconflicts(self, var, val, assignment)
+		if self.encoding == "nary":
+			for r, _ in self.cell_runs[var]:
+				total, free = int(val), 0
+				for cell in self.run_cells[r]:
+					if cell == var:
+						continue
+					if cell in assignment:
+						total += int(assignment[cell])
+					else:
+						free += 1
+				# free distinct digits add up to between free(free + 1)/2 and free(19 - free)/2
+				rest = self.sums[self.runs[r]] - total
+				if not free * (free + 1) // 2 <= rest <= free * (19 - free) // 2:
+					conflicts += 1
+		return conflicts
+
+	######### Domains
+	# Current domains are bitsets (see CSP.support_pruning): each X variable has a 9-bit mask of digits and each
+	# hidden variable a bitset of indices into its domain, which in bitmask mode are the rows of its table
+	# constraint that are still allowed.
+
+	def domain_bits(self, var):
+		if var[0] == "X":
+			return digits_mask(self.domains[var])
+		return CSP.domain_bits(self, var)
+
+	def bit_values(self, var):
+		if var[0] == "X":
+			return MASK_DIGITS[(1 << 9) - 1]
+		return self.domains[var]
+
+	""" Compatibility matrix of the arc (A, B) from run_matrix, or all-different in the nary encoding """
+	def compatibility_matrix(self, A, B):
+		if self.encoding == "nary":
+			return ~np.eye(9, dtype=bool)
+		if A[0] == "C":
+			return self.compatibility_matrix(B, A).T
+		r, pos = self.arcs[A, B]
+		return run_matrix(len(self.run_cells[r]), self.sums[B], pos)
+
+	""" For min-conflicts: the conflicts of a hidden variable are the cells of its run whose digit differs from that
+		of the permutation, so with numpy they are counted for every permutation at once from run_matrix """
+	def run_conflicts(self, run, current):
+		cells = self.run_cells[self.run_ids[run]]
+		counts = np.zeros(len(self.domains[run]), dtype=np.intp)
+		for pos, cell in enumerate(cells):
+			if cell in current:
+				counts += ~run_matrix(len(cells), self.sums[run], pos)[int(current[cell]) - 1]
+		return counts
+
+	def value_conflicts(self, var, current):
+		if var[0] == "X" or np is None:
+			return CSP.value_conflicts(self, var, current)
+		return self.run_conflicts(var, current).tolist()
+
+	def min_conflict_values(self, var, current):
+		if var[0] == "X" or np is None:
+			return CSP.min_conflict_values(self, var, current)
+		counts = self.run_conflicts(var, current)
+		return [self.domains[var][i] for i in np.flatnonzero(counts == counts.min())]
+
+	""" Return the bit of value in the current domain of var """
+	def value_bit(self, var, value):
+		if var[0] == "X":
+			return DIGIT_BITS[value]
+		return 1 << self.domains[var].index(value)
+
+	def choices(self, var):
+		if not self.curr_domains or var[0] != "X":
+			return CSP.choices(self, var)
+		return MASK_DIGITS[self.curr_domains[var]]
+
+	def forward_check(self, var, value, B, removals):
+		if not self.bitmask:
+			return CSP.forward_check(self, var, value, B, removals)
+		if B[0] == "C":
+			# B is the hidden variable of a run through var: keep the rows with value at var's position
+			r, pos = self.arcs[var, B]
+			keep = self.tables[r][pos][int(value) - 1]
+		elif var[0] == "X":
+			# B shares a run with var: all-different
+			keep = ~DIGIT_BITS[value]
+		else:
+			# var is the hidden variable of a run through B: B can only take its digit of value
+			keep = DIGIT_BITS[value[self.arcs[var, B][1]]]
+		if self.stats is not None:
+			self.stats.checks += self.curr_domains[B].bit_count() # One per value of B the mask tests
+		removed = self.curr_domains[B] & ~keep
+		if removed:
+			self.curr_domains[B] &= keep
+			if removals is not None:
+				removals.append((B, removed))
+		return self.curr_domains[B] != 0
 
 	def display(self, assignment=None):
 		for i in range(len(self.puzzle)): # Index for each line
@@ -217,206 +522,344 @@ class Kakuro(CSP):
 			print(line)
 			print()
 
-######### Solution of Kakuro Puzzle: Given, 4x3
-print("Kakuro puzzle: Given, 4x3\n")
-
-# BT + FC + MRV
-Kakuro_problem = Kakuro(kakuro_given4x3)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, inference=forward_checking)
-total_time = time() - start_time
-Kakuro_problem.display(assignments)
-print("\tHeuristic algorithms: BT + FC + MRV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + MAC + MRV
-Kakuro_problem = Kakuro(kakuro_given4x3)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, inference=mac)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + MAC + MRV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + FC + MRV + LCV
-Kakuro_problem = Kakuro(kakuro_given4x3)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, order_domain_values=lcv, inference=forward_checking)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + FC + MRV + LCV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + MAC + MRV + LCV
-Kakuro_problem = Kakuro(kakuro_given4x3)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, order_domain_values=lcv, inference=mac)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + MAC + MRV + LCV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.")
-
-
-######### Solution of Kakuro Puzzle: Given, 5x7
-print("\n\nKakuro puzzle: Given, 5x7\n")
-
-# BT + FC + MRV
-Kakuro_problem = Kakuro(kakuro_given5x7)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, inference=forward_checking)
-total_time = time() - start_time
-Kakuro_problem.display(assignments)
-print("\tHeuristic algorithms: BT + FC + MRV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + MAC + MRV
-Kakuro_problem = Kakuro(kakuro_given5x7)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, inference=mac)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + MAC + MRV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + FC + MRV + LCV
-Kakuro_problem = Kakuro(kakuro_given5x7)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, order_domain_values=lcv, inference=forward_checking)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + FC + MRV + LCV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + MAC + MRV + LCV
-Kakuro_problem = Kakuro(kakuro_given5x7)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, order_domain_values=lcv, inference=mac)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + MAC + MRV + LCV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.")
-
-
-######### Solution of Kakuro Puzzle: Given, 14x14
-print("\n\nKakuro puzzle: Given, 14x14\n")
-
-# BT + FC + MRV
-Kakuro_problem = Kakuro(kakuro_given14x14)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, inference=forward_checking)
-total_time = time() - start_time
-Kakuro_problem.display(assignments)
-print("\tHeuristic algorithms: BT + FC + MRV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + MAC + MRV
-Kakuro_problem = Kakuro(kakuro_given14x14)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, inference=mac)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + MAC + MRV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + FC + MRV + LCV
-Kakuro_problem = Kakuro(kakuro_given14x14)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, order_domain_values=lcv, inference=forward_checking)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + FC + MRV + LCV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + MAC + MRV + LCV
-Kakuro_problem = Kakuro(kakuro_given14x14)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, order_domain_values=lcv, inference=mac)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + MAC + MRV + LCV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.")
-
-
-######### Solution of Kakuro Puzzle: Intermediate, 6x6
-print("\n\nKakuro puzzle: Intermediate, 6x6\n")
-
-# BT + FC + MRV
-Kakuro_problem = Kakuro(kakuro_intermediate6x6)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, inference=forward_checking)
-total_time = time() - start_time
-Kakuro_problem.display(assignments)
-print("\tHeuristic algorithms: BT + FC + MRV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + MAC + MRV
-Kakuro_problem = Kakuro(kakuro_intermediate6x6)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, inference=mac)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + MAC + MRV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + FC + MRV + LCV
-Kakuro_problem = Kakuro(kakuro_intermediate6x6)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, order_domain_values=lcv, inference=forward_checking)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + FC + MRV + LCV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + MAC + MRV + LCV
-Kakuro_problem = Kakuro(kakuro_intermediate6x6)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, order_domain_values=lcv, inference=mac)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + MAC + MRV + LCV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-
-######### Solution of Kakuro Puzzle: Hard, 8x8
-print("\n\nKakuro puzzle: Hard, 8x8\n")
-
-# BT + FC + MRV
-Kakuro_problem = Kakuro(kakuro_hard8x8)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, inference=forward_checking)
-total_time = time() - start_time
-Kakuro_problem.display(assignments)
-print("\tHeuristic algorithms: BT + FC + MRV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + MAC + MRV
-Kakuro_problem = Kakuro(kakuro_hard8x8)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, inference=mac)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + MAC + MRV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + FC + MRV + LCV
-Kakuro_problem = Kakuro(kakuro_hard8x8)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, order_domain_values=lcv, inference=forward_checking)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + FC + MRV + LCV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.\n")
-
-# BT + MAC + MRV + LCV
-Kakuro_problem = Kakuro(kakuro_hard8x8)
-start_time = time()
-assignments = backtracking_search(Kakuro_problem, select_unassigned_variable=mrv, order_domain_values=lcv, inference=mac)
-total_time = time() - start_time
-print("\tHeuristic algorithms: BT + MAC + MRV + LCV")
-print("\tSolved in", total_time, "seconds.")
-print("\tMade", Kakuro_problem.nassigns, "assignments.")
\ No newline at end of file
+######### Inference for the nary encoding
+
+""" Given the current masks of the cells of a run and the masks of the digit sets that add up to its sum,
+	return for each cell the mask of the digits it can take in some digit set the run can still be filled with """
+def run_supports(masks, combos):
+	supports = [0] * len(masks)
+	for combo in combos:
+		restricted = [mask & combo for mask in masks]
+
+		# Take the digit of every cell left with a single digit away from the other cells, until nothing changes
+		fixed = 0
+		feasible = True
+		while feasible:
+			singles = 0
+			for mask in restricted:
+				if mask & (mask - 1) == 0: # No digit or a single one
+					if mask == 0 or singles & mask:
+						feasible = False
+						break
+					singles |= mask
+			if singles == fixed:
+				break
+			fixed = singles
+			restricted = [mask if mask & (mask - 1) == 0 else mask & ~fixed for mask in restricted]
+
+		if feasible:
+			# Every digit of the set must still have a cell to go to
+			union = 0
+			for mask in restricted:
+				union |= mask
+			if union == combo:
+				for k, mask in enumerate(restricted):
+					supports[k] |= mask
+	return supports
+
+""" Inference for Kakuro(..., encoding="nary"): prune the cell masks of the runs of var, and of every run
+	whose cells lose digits in turn, down to the digits of the digit sets each run can still be filled with """
+def sum_propagation(csp, var, value, assignment, removals):
+	csp.support_pruning()
+	domains = csp.curr_domains
+	queue = {r for r, _ in csp.cell_runs[var]}
+	while queue:
+		r = queue.pop()
+		cells = csp.run_cells[r]
+		combos = combination_masks(len(cells), csp.sums[csp.runs[r]])
+		supports = run_supports([domains[cell] for cell in cells], combos)
+		if csp.stats is not None:
+			csp.stats.checks += len(combos) * len(cells) # One per cell tested against each digit set
+		for cell, keep in zip(cells, supports):
+			removed = domains[cell] & ~keep
+			if removed:
+				domains[cell] = keep
+				if removals is not None:
+					removals.append((cell, removed))
+				if not keep:
+					for other in cells:
+						if other != cell:
+							csp.record_wipeout(cell, other)
+					return False
+				for other, _ in csp.cell_runs[cell]:
+					if other != r:
+						queue.add(other)
+	return True
+
+######### Compact-table propagation for the hidden encoding
+
+""" Constraint propagation for Kakuro(..., bitmask=True) in the hidden encoding, a drop-in for AC3 and AC3b
+	(e.g. as the constraint_propagation of mac). Each run is a table constraint whose current table is the
+	bitset domain of its hidden variable: revising a run intersects its table with the supports of the digits
+	left in its cells, then keeps in each cell the digits that still have a support in the table. Cells that
+	change queue their other run. Each arc of queue queues the run it belongs to (every run if queue is None).
+	Return (consistent, checks) with one check per support looked at. """
+def compact_table(csp, queue=None, removals=None):
+	csp.support_pruning()
+	domains = csp.curr_domains
+	if queue is None:
+		runs = set(range(len(csp.runs)))
+	else:
+		runs = {csp.arcs[arc][0] for arc in queue}
+	checks = 0
+	while runs:
+		r = runs.pop()
+		run, cells, supports = csp.runs[r], csp.run_cells[r], csp.tables[r]
+
+		# Rows of the table whose digit at every position is still in the cell there
+		table = domains[run]
+		for pos, cell in enumerate(cells):
+			allowed = 0
+			for k in MASK_INDICES[domains[cell]]:
+				allowed |= supports[pos][k]
+			checks += len(MASK_INDICES[domains[cell]])
+			table &= allowed
+		removed = domains[run] & ~table
+		if removed:
+			domains[run] = table
+			if removals is not None:
+				removals.append((run, removed))
+			if not table:
+				for cell in cells:
+					csp.record_wipeout(run, cell)
+				return False, checks # CSP is inconsistent
+
+		# Digits of each cell still supported by a row
+		for pos, cell in enumerate(cells):
+			keep = 0
+			for k in MASK_INDICES[domains[cell]]:
+				if supports[pos][k] & table:
+					keep |= 1 << k
+			checks += len(MASK_INDICES[domains[cell]])
+			removed = domains[cell] & ~keep
+			if removed:
+				domains[cell] = keep
+				if removals is not None:
+					removals.append((cell, removed))
+				if not keep:
+					csp.record_wipeout(cell, run)
+					return False, checks # CSP is inconsistent
+				for other, _ in csp.cell_runs[cell]:
+					if other != r:
+						runs.add(other)
+	return True, checks # CSP is satisfiable
+
+######### Command line interface: python -m kakuro
+
+SELECTIONS = {'first': first_unassigned_variable, 'mrv': mrv, 'mrv-buckets': bucket_mrv, 'dom-wdeg': dom_wdeg}
+ORDERINGS = {'unordered': unordered_domain_values, 'shuffled': shuffled_domain_values, 'lcv': lcv}
+INFERENCES = {'none': no_inference, 'fc': forward_checking, 'mac': mac, 'sum': sum_propagation}
+PROPAGATIONS = {'AC3': AC3, 'AC3b': AC3b, 'AC3rm': AC3rm, 'compact-table': compact_table}
+
+""" Return the keyword arguments of backtracking_search for the named heuristics """
+def search_config(select="mrv", order="unordered", inference="fc", propagation="AC3b"):
+	config = {"select_unassigned_variable": SELECTIONS[select],
+			  "order_domain_values": ORDERINGS[order],
+			  "inference": INFERENCES[inference]}
+	if inference == "mac" and propagation != "AC3b":
+		config["inference"] = partial(mac, constraint_propagation=PROPAGATIONS[propagation])
+	return config
+
+""" Name of the combination of heuristics, e.g. BT + FC + MRV + LCV (CBJ + ... with backjumping, ... + LUBY RESTARTS with restarts) """
+def search_label(select="mrv", order="unordered", inference="fc", propagation="AC3b", backjump=False, restarts=None):
+	label = "CBJ" if backjump else "BT"
+	if inference != "none":
+		label += " + " + inference.upper()
+		if inference == "mac" and propagation != "AC3b":
+			label += " (" + propagation + ")"
+	if select != "first":
+		label += " + " + select.upper()
+	if order != "unordered":
+		label += " + " + order.upper()
+	if restarts:
+		label += " + " + restarts.upper() + " RESTARTS"
+	return label
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m kakuro", description="Solve bundled Kakuro puzzles "
+									 "with every combination of the selected inferences and value orders.")
+	parser.add_argument("puzzles", nargs="*", metavar="PUZZLE",
+						help="bundled puzzles to solve: " + ", ".join(PUZZLES) + " (default: all)")
+	parser.add_argument("--select", choices=SELECTIONS, default="mrv", help="variable ordering (default: mrv)")
+	parser.add_argument("--order", choices=ORDERINGS, action="append",
+						help="value ordering; repeat to try several (default: unordered and lcv)")
+	parser.add_argument("--inference", choices=INFERENCES, action="append",
+						help="inference; repeat to try several (default: fc and mac)")
+	parser.add_argument("--propagation", choices=PROPAGATIONS, default="AC3b",
+						help="constraint propagation of mac (default: AC3b)")
+	parser.add_argument("--encoding", choices=("hidden", "nary"), default="hidden", help="run encoding (default: hidden)")
+	parser.add_argument("--bitmask", action="store_true", help="propagate runs through bitset table constraints")
+	parser.add_argument("--matrices", action="store_true",
+						help="revise arcs and forward check with compatibility matrices (needs numpy)")
+	parser.add_argument("--backjump", action="store_true",
+						help="search with conflict-directed backjumping (inference fc or none only)")
+	parser.add_argument("--nogoods", type=int, default=0, metavar="N",
+						help="with --backjump, keep up to N learned nogoods (default: 0)")
+	parser.add_argument("--restarts", choices=RESTART_SCHEDULES,
+						help="restart the search after a number of dead ends following this schedule")
+	parser.add_argument("--seed", type=int, help="seed of the random tie-breaking, for reproducible runs")
+	parser.add_argument("--stats", action="store_true",
+						help="record search statistics: backtracks, checks, prunings, wipeouts, depth and timings")
+	parser.add_argument("--format", choices=("text", "json"), default="text",
+						help="text: grids and timings; json: one JSON object per solve")
+	parser.add_argument("--count", type=int, metavar="LIMIT",
+						help="count solutions instead, up to LIMIT (0: all); --count 2 checks uniqueness")
+	parser.add_argument("--components", type=int, metavar="WORKERS", nargs="?", const=0,
+						help="solve the independent regions of each puzzle separately, "
+							 "in WORKERS processes if given, and report each one")
+	batch = parser.add_argument_group("batch mode", "solve the puzzles of a puzzle file (see corpus.py) "
+									  "across a process pool instead of bundled puzzles")
+	batch.add_argument("--corpus", metavar="PATH", help="puzzle file to solve")
+	batch.add_argument("--workers", type=int, help="worker processes; 0 solves in this process (default: one per core)")
+	batch.add_argument("--chunksize", type=int, default=8, help="puzzles sent to a worker at a time (default: 8)")
+	batch.add_argument("--timeout", type=float, help="time limit per puzzle, in seconds")
+	batch.add_argument("--unordered", action="store_true", help="report results as they finish, not in file order")
+	args = parser.parse_args(argv)
+
+	for name in args.puzzles:
+		if name not in PUZZLES:
+			parser.error("unknown puzzle: " + name)
+	if args.propagation == "compact-table" and not (args.bitmask and args.encoding == "hidden"):
+		parser.error("--propagation compact-table needs --bitmask and --encoding hidden")
+	if "sum" in (args.inference or []) and args.encoding != "nary":
+		parser.error("--inference sum needs --encoding nary")
+	if args.corpus:
+		if args.puzzles:
+			parser.error("give either bundled puzzles or --corpus")
+		if args.matrices or args.backjump or args.restarts or args.count is not None or args.components is not None:
+			parser.error("--matrices, --backjump, --restarts, --count and --components do not work with --corpus")
+		return solve_corpus(args)
+	if args.matrices and np is None:
+		parser.error("--matrices needs numpy")
+	if args.backjump or args.restarts:
+		if args.count is not None:
+			parser.error("--backjump and --restarts find one solution; they do not count them")
+	if args.backjump and set(args.inference or []) - {"fc", "none"}:
+		parser.error("--backjump works with --inference fc or none")
+	if args.restarts:
+		search = partial(restart_search, schedule=args.restarts, seed=args.seed, backjump=args.backjump,
+						 max_nogoods=args.nogoods)
+	elif args.backjump:
+		search = partial(cbj_search, max_nogoods=args.nogoods)
+	else:
+		search = backtracking_search
+	if args.seed is not None:
+		random.seed(args.seed)
+
+	for n, name in enumerate(args.puzzles or PUZZLES):
+		if args.format == "text":
+			print("\n\n" * (n > 0) + "Kakuro puzzle: " + name + "\n")
+		for k, (inference, order) in enumerate((inference, order) for order in args.order or ["unordered", "lcv"]
+											   for inference in args.inference or (["fc"] if args.backjump else ["fc", "mac"])):
+			heuristics = dict(select=args.select, order=order, inference=inference, propagation=args.propagation)
+			label = search_label(backjump=args.backjump, restarts=args.restarts, **heuristics)
+			Kakuro_problem = Kakuro(PUZZLES[name], bitmask=args.bitmask, encoding=args.encoding)
+			if args.stats:
+				Kakuro_problem.stats = SearchStats()
+			if args.matrices:
+				Kakuro_problem.matrices = CompatibilityMatrices()
+			if args.count is not None:
+				count_puzzle(name, Kakuro_problem, heuristics, args)
+				continue
+			start_time = time()
+			if args.components is None:
+				assignments = search(Kakuro_problem, **search_config(**heuristics))
+				components = None
+			else:
+				assignments, components = solve_components(Kakuro_problem, solver=search, workers=args.components,
+															**search_config(**heuristics))
+			total_time = time() - start_time
+
+			if args.format == "json":
+				record = {"puzzle": name, "algorithms": label,
+						  "solved": assignments is not None, "seconds": total_time,
+						  "assignments": Kakuro_problem.nassigns,
+						  "solution": assignments and {v: x for v, x in assignments.items() if v[0] == "X"}}
+				if components is not None:
+					record["components"] = [stats._asdict() for stats in components]
+				if args.backjump and components is None:
+					record["backjumps"] = Kakuro_problem.nbackjumps
+				if args.restarts and components is None:
+					record["restarts"] = Kakuro_problem.nrestarts
+				if args.stats:
+					record["stats"] = Kakuro_problem.stats.as_dict()
+				print(json.dumps(record))
+				continue
+			if k == 0:
+				Kakuro_problem.display(assignments)
+			print("\tHeuristic algorithms:", label)
+			if assignments is None:
+				print("\tNo solution.")
+			print("\tSolved in", total_time, "seconds.")
+			made = str(Kakuro_problem.nassigns) + " assignments"
+			if args.backjump and components is None:
+				made += ", jumping back over " + str(Kakuro_problem.nbackjumps) + " variables"
+			if args.restarts and components is None:
+				made += ", over " + str(Kakuro_problem.nrestarts + 1) + " runs"
+			print("\tMade", made + "." + "\n" * (not args.stats))
+			if args.stats:
+				print_stats(Kakuro_problem.stats)
+			for c, stats in enumerate(components or []):
+				print("\tComponent", c, "of", stats.variables, "variables:", "solved" if stats.solved else "no solution",
+					  "in", stats.seconds, "seconds with", stats.nassigns, "assignments.")
+			if components:
+				print()
+
+
+""" Counting mode of main: count the solutions of Kakuro_problem up to args.count """
+def count_puzzle(name, Kakuro_problem, heuristics, args):
+	counted = count_solutions(Kakuro_problem, limit=args.count or None, **search_config(**heuristics))
+	if args.format == "json":
+		record = {"puzzle": name, "algorithms": search_label(**heuristics), "limit": args.count or None,
+				  "solutions": counted.count, "nodes": counted.nodes, "seconds": counted.seconds}
+		if args.stats:
+			record["stats"] = Kakuro_problem.stats.as_dict()
+		print(json.dumps(record))
+		return
+	print("\tHeuristic algorithms:", search_label(**heuristics))
+	print("\tFound", counted.count, "solutions" + (" (limit reached)" if not counted.complete else "") + ".")
+	print("\tCounted in", counted.seconds, "seconds.")
+	print("\tMade", counted.nodes, "assignments." + "\n" * (not args.stats))
+	if args.stats:
+		print_stats(Kakuro_problem.stats)
+
+
+""" Text mode of --stats: summarize the SearchStats of a solve, with the variables most often wiped out """
+def print_stats(stats, top=3):
+	print("\tBacktracked", stats.backtracks, "times to a maximum depth of", stats.max_depth, "variables, with",
+		  stats.checks, "constraint checks.")
+	print("\tPruned", sum(stats.prunings.values()), "values and wiped out", sum(stats.wipeouts.values()), "domains"
+		  + "".join(", " + str(var) + " " + str(n) + " times" for var, n in stats.wipeouts.most_common(top)) + ".")
+	print("\tSpent", format(stats.select_seconds, ".4f"), "s selecting variables,", format(stats.order_seconds, ".4f"),
+		  "s ordering values and", format(stats.inference_seconds, ".4f"), "s in inference.\n")
+
+
+""" Batch mode of main: solve the puzzles of args.corpus with solve_many, once per combination of heuristics """
+def solve_corpus(args):
+	from batch import solve_many
+	from corpus import iter_puzzles
+
+	for inference, order in ((inference, order) for order in args.order or ["unordered"]
+							 for inference in args.inference or ["fc"]):
+		heuristics = dict(select=args.select, order=order, inference=inference, propagation=args.propagation)
+		config = dict(heuristics, bitmask=args.bitmask, encoding=args.encoding, stats=args.stats)
+		start_time = time()
+		counts = {}
+		for result in solve_many(iter_puzzles(args.corpus), workers=args.workers, config=config,
+								 chunksize=args.chunksize, ordered=not args.unordered, timeout=args.timeout):
+			counts[result.status] = counts.get(result.status, 0) + 1
+			name = result.name if result.name is not None else "#" + str(result.index)
+			if args.format == "json":
+				print(json.dumps(dict(result._asdict(), algorithms=search_label(**heuristics))))
+			else:
+				print(name + "\t" + result.status + "\t" + format(result.seconds, ".4f") + " s\t"
+					  + str(result.assignments) + " assignments" + ("\t" + result.error if result.error else ""))
+		if args.format == "text":
+			total_time = time() - start_time
+			print("\tHeuristic algorithms:", search_label(**heuristics))
+			print("\tSolved", sum(counts.values()), "puzzles in", total_time, "seconds:",
+				  ", ".join(str(n) + " " + status for status, n in sorted(counts.items())) + ".\n")
+
+
+if __name__ == "__main__":
+	main()
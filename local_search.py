@@ -0,0 +1,188 @@
+"""Local search for CSPs: min-conflicts with tabu, random walk and plateau moves.
+
+    >>> problem = Kakuro(PUZZLES['given14x14'])                           # doctest: +SKIP
+    >>> result = tabu_search(problem, max_seconds=1, seed=0)              # doctest: +SKIP
+    >>> result.conflicts, len(conflict_free(problem, result.assignment))  # doctest: +SKIP
+
+A run starts from a complete assignment made variable by variable, as min_conflicts does.
+Each step picks a variable in conflict at random and, with probability walk, gives it a
+random other value (a random walk step); otherwise it gives it the value with the fewest
+conflicts among the others. Values a variable just left stay tabu for tenure steps, so the
+search does not undo its moves, unless taking one would beat the best assignment so far.
+A move that leaves the conflicts of the variable unchanged is a plateau move; at most
+max_plateau of them are made in a row. The conflicts are kept up to date incrementally
+(csp.ConflictCounts), so a step costs in the degree of the variable and the size of its
+domain, not in the size of the CSP, and the run returns the best assignment it found: an
+anytime answer where systematic search is too slow. Runs from different random starts can
+be spread over a process pool with parallel_local_search, which keeps the best of them.
+Any CSP works as it is, Kakuro included, as long as it pickles for the pool.
+
+Run as `python -m local_search [PUZZLE ...] [--seconds S] [--runs N] [--workers N]`.
+"""
+
+import argparse
+import json
+import os
+import random
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+from csp import ConflictCounts
+from kakuro import PUZZLES, Kakuro
+
+# A local search run: the complete assignment with the fewest conflicts it found, the sum of
+# the conflicts of its variables (0 for a solution), the steps taken, the time and the seed
+LocalSearchResult = namedtuple('LocalSearchResult', 'assignment conflicts steps seconds seed')
+
+
+def initial_assignment(csp, rng):
+    """Return a complete assignment made variable by variable, each taking a value with the
+    fewest conflicts with those before it, ties broken with rng."""
+    current = {}
+    for var in csp.variables:
+        csp.assign(var, rng.choice(csp.min_conflict_values(var, current)), current)
+    return current
+
+
+def tabu_search(csp, max_steps=100000, tenure=10, walk=0.05, max_plateau=20, max_seconds=None, seed=None):
+    """Run local search on csp for up to max_steps steps and max_seconds seconds (None for
+    no limit), or until a solution, and return its LocalSearchResult. tenure is the number of
+    steps a value left by a variable stays tabu for it, walk the probability of a random walk
+    step and max_plateau the most plateau moves in a row. The aspiration test, whether a
+    tabu value would beat the best assignment, takes each conflict to count at both ends, as
+    in binary CSPs; for constraints over more variables it is an estimate. seed seeds the
+    random choices of the run."""
+    rng = random.Random(seed)
+    start = perf_counter()
+    current = initial_assignment(csp, rng)
+    counts = ConflictCounts(csp, current)
+    indices = {var: csp.domains[var].index(val) for var, val in current.items()}  # Index of each value in its domain
+    tabu = {}  # {(var, index of a value): step until which var may not take it back}
+    best, best_conflicts = dict(current), counts.total
+    plateau = 0  # Plateau moves in a row
+    step = 0
+    while best_conflicts and step < max_steps:
+        if max_seconds is not None and perf_counter() - start >= max_seconds:
+            break
+        step += 1
+        var = rng.choice(counts.conflicted)
+        domain = csp.domains[var]
+        i = indices[var]
+        if len(domain) < 2:
+            continue
+        if rng.random() < walk:
+            j = rng.randrange(len(domain) - 1)
+            j += j >= i  # Any value but the current one
+        else:
+            conflicts = csp.value_conflicts(var, current)
+            own = conflicts[i]
+            fewest, ties = None, []
+            for k, n in enumerate(conflicts):
+                if k == i or fewest is not None and n > fewest:
+                    continue
+                if tabu.get((var, k), 0) > step and counts.total + 2 * (n - own) >= best_conflicts:
+                    continue  # Tabu, and no better than the best
+                if fewest is None or n < fewest:
+                    fewest, ties = n, [k]
+                else:
+                    ties.append(k)
+            if fewest is None or fewest > own:
+                continue  # Every move makes var worse: leave it to the random walk
+            if fewest == own:
+                if plateau >= max_plateau:
+                    continue
+                plateau += 1
+            else:
+                plateau = 0
+            j = rng.choice(ties)
+        tabu[var, i] = step + tenure
+        indices[var] = j
+        counts.assign(var, domain[j])
+        if counts.total < best_conflicts:
+            best, best_conflicts = dict(current), counts.total
+    return LocalSearchResult(best, best_conflicts, step, perf_counter() - start, seed)
+
+
+def conflict_free(csp, assignment):
+    """Return the part of assignment whose variables have no conflicts in it: with binary
+    constraints, a consistent partial assignment."""
+    return {var: val for var, val in assignment.items() if not csp.nconflicts(var, val, assignment)}
+
+
+def parallel_local_search(csp, runs=None, workers=None, seed=None, **kwargs):
+    """Run tabu_search(csp, seed=seed + n, **kwargs) for n in range(runs) (by default one
+    run per worker), in workers processes (0: in this process; None: one per core), and
+    return the LocalSearchResult with the fewest conflicts, the first run breaking ties.
+    Once a run finds a solution, the runs not started yet are dropped; with a pool, those
+    already started still run to their limits, so give them max_seconds."""
+    base = random.randrange(2 ** 32) if seed is None else seed
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    seeds = [base + n for n in range(runs or workers or 1)]
+
+    def key(result):
+        return result.conflicts, result.seed - base
+
+    best = None
+    if workers == 0:
+        for run_seed in seeds:
+            result = tabu_search(csp, seed=run_seed, **kwargs)
+            best = result if best is None else min(best, result, key=key)
+            if not best.conflicts:
+                break
+        return best
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(tabu_search, csp, seed=run_seed, **kwargs) for run_seed in seeds]
+        for future in as_completed(futures):
+            result = future.result()
+            best = result if best is None else min(best, result, key=key)
+            if not best.conflicts:
+                for other in futures:
+                    other.cancel()
+                break
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m local_search',
+                                     description='Look for solutions of bundled Kakuro puzzles by local search, '
+                                                 'keeping the assignment with the fewest conflicts.')
+    parser.add_argument('puzzles', nargs='*', metavar='PUZZLE',
+                        help='bundled puzzles to solve (default: all): ' + ', '.join(PUZZLES))
+    parser.add_argument('--encoding', choices=('hidden', 'nary'), default='hidden',
+                        help='run encoding (default: hidden)')
+    parser.add_argument('--steps', type=int, default=100000, help='steps per run (default: 100000)')
+    parser.add_argument('--seconds', type=float, default=10.0, help='time limit per run (default: 10)')
+    parser.add_argument('--tenure', type=int, default=10, help='steps a value left stays tabu (default: 10)')
+    parser.add_argument('--walk', type=float, default=0.05, help='probability of a random walk step (default: 0.05)')
+    parser.add_argument('--plateau', type=int, default=20, help='most plateau moves in a row (default: 20)')
+    parser.add_argument('--runs', type=int, help='runs from different random starts (default: one per worker)')
+    parser.add_argument('--workers', type=int, help='worker processes; 0 runs in this process '
+                                                    '(default: one per core)')
+    parser.add_argument('--seed', type=int, help='seed of the first run; the next ones use seed + 1, ...')
+    parser.add_argument('--format', choices=('text', 'json'), default='text',
+                        help='text: grids of the conflict-free cells; json: one JSON object per puzzle')
+    args = parser.parse_args(argv)
+
+    for name in args.puzzles:
+        if name not in PUZZLES:
+            parser.error('unknown puzzle: ' + name)
+    for name in args.puzzles or PUZZLES:
+        problem = Kakuro(PUZZLES[name], encoding=args.encoding)
+        result = parallel_local_search(problem, args.runs, args.workers, args.seed, max_steps=args.steps,
+                                       max_seconds=args.seconds, tenure=args.tenure, walk=args.walk,
+                                       max_plateau=args.plateau)
+        cells = {var: val for var, val in conflict_free(problem, result.assignment).items() if var[0] == 'X'}
+        if args.format == 'json':
+            print(json.dumps({'puzzle': name, 'conflicts': result.conflicts, 'steps': result.steps,
+                              'seconds': result.seconds, 'seed': result.seed, 'assignment': cells}))
+            continue
+        print('Kakuro puzzle: {}\n'.format(name))
+        problem.display(cells)
+        print('\t{} conflicts after {} steps in {:.3f} s (seed {}); {} of {} cells conflict-free.\n'.format(
+            result.conflicts, result.steps, result.seconds, result.seed, len(cells),
+            sum(var[0] == 'X' for var in problem.variables)))
+
+
+if __name__ == '__main__':
+    main()